@@ -7,9 +7,12 @@
 
 import numpy as np
 from numpy import pi
-from qutip import *
-import matplotlib.pyplot as plt
-import utils.operators as operators
+from qutip import basis, tensor, mesolve, solver, Options
+from trappedionsqsim.utils import operators, instrument
+from trappedionsqsim.utils.coefficients import PhaseTable
+from trappedionsqsim.utils.hamiltonian import merge_terms, secular_approximation, detect_period
+from trappedionsqsim.utils.floquet import period_propagator, FloquetPropagator
+from trappedionsqsim.utils.diskcache import result_key
 import experiment
 import groundcoupling
 
@@ -26,266 +29,356 @@ ground = [0, 12640, 12640, 12640]
 detuning = [-33000000, -33000000, -33000000, -33000000, 66000000, 66000000, 66000000, 66000000, 66000000, 66000000, 66000000, 66000000]
 ##############################################################################################################################
 
+def levelStructure():
 
-###############################################################################################################################
-##################A simulation of single qubit Raman Dynamics in Bichromatic Field#############################################
-###############################################################################################################################
-###############################################################################################################################
+    """Level structure tables of the ground and intermediate states, e.g. for cache keys"""
 
-def SQramanDynamicsBC(Expm):
-    
-    if (Expm.B_C):
-        det = Expm.Dets
-        EP = Expm.E[0][0]
-        ES = Expm.E[1][0]
-        tmax = Expm.tmax
-        tstep = Expm.tstep
-        dPhase = Expm.P
-        
-        gc = groundcoupling.GroundCoupling(detuning, fint, mint, fg, mg, dipole)
-        
-        H = []
-        
-        #########Calculate Second Order Stark Shift#########
-        ss = []
-        
-        ss.append(gc.getCoupling(0, 0, EP, EP))
-        
-        for i in range(1, 4):
-            
-            ss.append(gc.getCoupling(i, i, ES, ES))
-        
-        ####################################################
-        
-        #########Calculate Couplings################
-        O = [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
-        
-        for i in range(1, 4):
-            O[0][i] = gc.getCoupling(0, i, EP, ES)
-            O[i][0] = np.conjugate(O[0][i])
-        
-        for i in range(1, 4):
-            for j in range(1, 4):
-                O[i][j] = gc.getCoupling(i, j, ES, ES)
-        ############################################
+    return {'mg': mg, 'fg': fg, 'fint': fint, 'mint': mint, 'dipole': dipole, 'ground': ground, 'detuning': detuning}
 
-        ##########Calculate Detunings From Degenerate Levels###############
-        dets = [0, 0, 0]
 
-        for i in range(1, 4):
+def cacheKey(name, Expm, gc, options, *args):
 
-            dets[i - 1] = det + (ground[2] - ground[i]) + (ss[2] - ss[i])
+    """Key of a dynamics run in a diskcache.ResultCache: experiment, level structure, couplings, options and
+       time grid. gc = None keys on the default groundCoupling(), whose parameters are hashed, not its cache;
+       options = None keys on the default solver Options() used by the runners"""
 
-        ##################################################################
+    if gc is None:
+        gc = groundCoupling()
+    if options is None:
+        options = Options()
 
-        for i in range(1,4):
-            for j in range(1,4):
-                if(i != j):
-                    func = ('exp(1j*(%f*t))' % (det[i-1] - det[j-1]))
-                    H.append([O[i][j]*basis(4, i)*basis(4, j).dag(), func])
+    return result_key(name, Expm, levelStructure(), gc, np.linspace(0, Expm.tmax, Expm.tstep), options, *args)
 
-        for i in range(1,4):
-            func = ('exp(1j*(%f*t))' % (det[i-1]))
-            H.append([O[i][0]*basis(4, i)*basis(4, 0).dag(), func])
 
+def groundCoupling():
 
-        for i in range(1,4):
-            func = ('exp(-1j*(%f*t))' % (det[i-1]))
-            H.append([O[i][0]*basis(4, i)*basis(4, 0).dag(), func])
+    """Two-photon ground state couplings of the level structure above, shareable between simulations"""
 
+    return groundcoupling.GroundCoupling(detuning, fint, mint, fg, mg, dipole)
 
-        psi0 = basis(4, 0)
 
-        t = np.linspace(0, tmax, tstep)
-        sol = mesolve(H, psi0, t, [], [], progress_bar = True)
+def floquetDynamics(terms, psi0, tmax, tstep, period = None, options = None):
 
-        return sol
+    """States at every period of the periodic Hamiltonian terms up to tmax, from its one-period propagator"""
 
-    else:
+    if period is None:
+        period = detect_period(terms)
+        if period is None:
+            raise ValueError("Frequencies are not commensurate; set the period")
+    ####Integrate One Period on the Same Step Size as the Full Grid####
+    N_p = int(np.floor(tmax/period + 1e-9))
+    steps = max(2, int(np.ceil(tstep*period/tmax)) + 1)
+    with instrument.timer('raman.solver'):
+        F = FloquetPropagator(period_propagator(terms, period, 0., steps, options), period)
 
-        print("Not valid Bichromatic experiment")
+    sol = solver.Result()
+    sol.solver = 'floquet'
+    sol.times = period*np.arange(N_p + 1)
+    sol.states = F.stroboscopic(psi0, np.arange(N_p + 1))
+    sol.floquet = F
 
+    return sol
 
 
-##########################################################################################################################################
-##################A simulation of Phonon Coupled Raman Dynamics in a Bichromatic Field#################################################
-###########################################################################################################################################
-def MQramanDynamicsBC(Expm):
-    
-    
-    
-    modes = Expm.N_m
-    trunc = Expm.D_f
-    vibF = Expm.interactionFrequencies()
-    Phase = Expm.P
-    tstep = Expm.tstep
-    tmax = Expm.tmax
-    ES = Expm.F_s[1]
+###############################################################################################################################
+##################A simulation of single qubit Raman Dynamics in Bichromatic Field#############################################
+###############################################################################################################################
+###############################################################################################################################
+
+def SQramanTermsBC(Expm, gc = None):
+
+    """Frequency-tagged Hamiltonian terms [[H, w, phi], ...] = sum_k H_k exp(1j*(w_k*t + phi_k))"""
+
+    det = Expm.Dets
     EP = Expm.F_s[0][0]
-    detBR = Expm.Dets
-    eta = Expm.Dicke
-    
-    
-    gc = groundcoupling.GroundCoupling(detuning, fint, mint, fg, mg, dipole)
-    
-    if (Expm.B_C):
-        
-        #######Calculate 2nd Order Stark Effect######
-        ss = [0, 0, 0, 0]
-        ss[0] = ss[0] + gc.getCoupling(0, 0, EP, EP)
-        for c in range(0,2):
-                for i in range(1,4):
-                        ss[i] = ss[i] + gc.getCoupling(i, i, ES[c], ES[c])
-        #############################################
-
-
-        O = [[[[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]],[[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]]],
-             [[[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]],[[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]]]]
-        ####Store Effective Rabi Couplings################
-        for c in range(0, 2):
-            for i in range(1, 4):
-                    O[c][0][i][0] += gc.getCoupling(i, 0, ES[c], EP)
-                    O[c][0][0][i] += np.conjugate(O[c][0][i][0])
+    ES = Expm.F_s[1][0]
 
-        for c1 in range(0, 2):
-            for c2 in range(0, 2):
-                for i in range(1, 4):
-                    for j in range(1, 4):
-                        O[c1][c2][j][i] = gc.getCoupling(j, i, ES[c1], ES[c2])
+    if gc is None:
+        gc = groundCoupling()
 
-        print(O[0][0][2][0])
-        ######################################################
+    H = []
 
-        det = [[0, 0, 0], [0, 0, 0]]
-        #Calculate Detuning from resonance for all States up to 2nd order stark shift#
-        for c in range(0,2):
-            for i in range(1, 4):
-                det[c][i - 1] = detBR[c] + ((ground[2] - ground[i]) + (ss[2] - ss[i]))
+    #########Calculate Second Order Stark Shift#########
+    ss = []
 
-        det = np.real(det)
-        ##############################################################################
+    ss.append(gc.getCoupling(0, 0, EP, EP))
 
+    for i in range(1, 4):
 
+        ss.append(gc.getCoupling(i, i, ES, ES))
 
-        H = []
-        HM = []
-        op = operators.Operators(2, 4, modes, trunc)
+    ####################################################
 
-        #######Create Motional Hamiltonian Components##########
-        for m in range(0, modes):
-            HM.append([op.id(), eta[m]*1j*op.ad(m+1), eta[m]*1j*op.a(m+1)])
-
-        ######################################################
-
-        #####First Ion Hamiltonian#####
-        for m in range(0, modes):
-            for e in range(0, 3):
-                for c in range(0, 2):
-                    for i in range(0, 3):
-                        func = ('exp(1j*(%f*t + %f))' % (det[c][i]+vibF[m][e], Phase[c]))
-                        H.append([O[c][0][i + 1][0]*op.coupling([[-1, 0]], [[-1, i + 1]])*HM[m][e], func])
-
-
-        for m in range(0, modes):
-            for e in range(0, 3):
-                for c in range(0, 2):
-                    for i in range(0, 3):
-                        func = ('exp(-1j*(%f*t + %f))' % (det[c][i]+vibF[m][e], Phase[c]))
-                        H.append([O[c][0][0][i + 1]*op.coupling([[]-1, i + 1]], [[-1, 0]])*HM[m][e].dag(), func])
-
-        for c1 in range(0, 2):
-            for c0 in range(0, 2):
-                for i in range(1, 4):
-                    for j in range(1, 4):
-                        if (i != j):
-                            func = ('exp(1j*(%f*t + %f))' % (det[c1][i-1] - det[c0][j-1], Phase[c0] - Phase[c1]))
-                            H.append([O[c][0][i][j]*op.coupling([[-1, j]], [[-1, i]])*op.id(), func])
-
-        #######################################
-
-        ####Second Ion Hamiltonian#####
-        for m in range(0, modes):
-            for e in range(0, 3):
-                for c in range(0, 2):
-                    for i in range(0, 3):
-                        func = ('exp(1j*(%f*t + %f))' % (det[c][i]+vibF[m][e], Phase[c]))
-                        H.append([O[c][0][i + 1][0]*op.coupling([[0, -1]], [[i + 1, -1]])*HM[m][e], func])
-
-        for m in range(0, modes):
-            for e in range(0, 3):
-                for c in range(0, 2):
-                    for i in range(0, 3):
-                        func = ('exp(-1j*(%f*t + %f))' % (det[c][i]+vibF[m][e], Phase[c]))
-                        H.append([O[c][0][0][i + 1]*op.coupling([[i + 1, -1]], [[0, -1]])*HM[m][e].dag(), func])
-
-        for c1 in range(0, 2):
-            for c0 in range(0, 2):
-                for i in range(1, 4):
-                    for j in range(1, 4):
-                        if (i != j):
-                            func = ('exp(1j*(%f*t + %f))' % (det[c1][i-1] - det[c0][j-1], Phase[c0] - Phase[c1]))
-                            H.append([O[c][0][i][j]*op.coupling([[j, -1]], [[i, -1]])*op.id(), func])
-
-        #########################################
+    #########Calculate Couplings################
+    O = [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]]
 
-        #######Simulate Dynamics########
-        t = np.linspace(0, tmax, tstep)
-        ###Start in Ground State of All Modes###
-        psi0 = tensor(basis(4, 0), basis(4, 0), tensor([basis(trunc, 0) for i in range(0, modes)]))
-        ########################################
-        data = mesolve(H, psi0, t, [], [], progress_bar = True)
+    for i in range(1, 4):
+        O[0][i] = gc.getCoupling(0, i, EP, ES)
+        O[i][0] = np.conjugate(O[0][i])
 
-        return data
+    for i in range(1, 4):
+        for j in range(1, 4):
+            O[i][j] = gc.getCoupling(i, j, ES, ES)
+    ############################################
+
+    ##########Calculate Detunings From Degenerate Levels###############
+    shift = np.real([(ground[2] - ground[i]) + (ss[2] - ss[i]) for i in range(1, 4)])
 
+    ####Dets = [red, blue] gives one tone per detuning, a scalar det the tones +-(det + shift)####
+    if np.ndim(det) == 0:
+        dets = [det + shift, -(det + shift)]
     else:
+        dets = [d + shift for d in det]
+    ##################################################################
 
-        print("Not Valid Bichromatic Experiment")
+    for i in range(1,4):
+        for j in range(1,4):
+            if(i != j):
+                H.append([O[i][j]*basis(4, i)*basis(4, j).dag(), shift[i-1] - shift[j-1], 0.])
 
-        return null
+    for d in dets:
+        for i in range(1,4):
+            H.append([O[i][0]*basis(4, i)*basis(4, 0).dag(), d[i-1], 0.])
 
+    return H
 
-###########################################################################################################
 
+def SQramanDynamicsBC(Expm, rwa_cutoff = None, rwa_order = 2, gc = None, floquet = False, period = None, cache = None,
+                      options = None):
 
+    """floquet = True returns the states at every period only (see floquetDynamics)
+       The report of the secular approximation (None without rwa_cutoff) is attached as .secular,
+       except to results read from the cache
+       cache is an optional diskcache.ResultCache returning stored results of identical runs;
+       floquet runs are not cached, since their result carries the propagator (.floquet)
+       options is an optional qutip Options instance of the solver"""
 
+    if (Expm.B_C and cache is not None and not floquet):
+        key = cacheKey('SQramanDynamicsBC', Expm, gc, options, rwa_cutoff, rwa_order)
+        return cache.get_or_run(key, lambda: SQramanDynamicsBC(Expm, rwa_cutoff, rwa_order, gc, options = options))
 
+    if (Expm.B_C):
+        tmax = Expm.tmax
+        tstep = Expm.tstep
 
+        t = np.linspace(0, tmax, tstep)
+        with instrument.timer('raman.terms'):
+            terms = SQramanTermsBC(Expm, gc)
+        with instrument.timer('raman.coefficients'):
+            terms = merge_terms(terms)
+            ####Drop Terms Rotating Faster Than rwa_cutoff x Coupling####
+            report = None
+            if rwa_cutoff is not None:
+                terms, report = secular_approximation(terms, rwa_cutoff, rwa_order)
 
+        psi0 = basis(4, 0)
 
+        if floquet:
+            sol = floquetDynamics(terms, psi0, tmax, tstep, period, options)
+            sol.secular = report
+            return sol
 
+        with instrument.timer('raman.coefficients'):
+            H = PhaseTable(t).hamiltonian(terms)
 
-####Define Experiment####
-Expm = experiment.Experiment(B_C = True, N_m = 1, D_f = 20, F_f = [3], Dets = [-2.85, 2.85],
-                             F_s = [[[15000, 0, 0]], [[0, 15000, 0], [0, 15000, 0]]],
-                             P = [0, 0], Dicke = [.1], t = 200, tstep = 40000)
-#########################
+        with instrument.timer('raman.solver'):
+            sol = mesolve(H, psi0, t, [], [], options = options, progress_bar = True)
+        sol.secular = report
 
+        return sol
 
+    else:
 
+        print("Not valid Bichromatic experiment")
 
 
 
+##########################################################################################################################################
+##################A simulation of Phonon Coupled Raman Dynamics in a Bichromatic Field#################################################
+###########################################################################################################################################
+def MQramanTermsBC(Expm, gc = None, op = None):
 
+    """Frequency-tagged Hamiltonian terms [[H, w, phi], ...] = sum_k H_k exp(1j*(w_k*t + phi_k))"""
 
+    modes = Expm.N_m
+    trunc = Expm.D_f
+    vibF = Expm.interactionFrequencies()
+    Phase = Expm.P
+    ES = Expm.F_s[1]
+    EP = Expm.F_s[0][0]
+    detBR = Expm.Dets
+    eta = Expm.Dicke
+    
+    
+    if gc is None:
+        gc = groundCoupling()
+
+    #######Calculate 2nd Order Stark Effect######
+    ss = [0, 0, 0, 0]
+    ss[0] = ss[0] + gc.getCoupling(0, 0, EP, EP)
+    for c in range(0,2):
+            for i in range(1,4):
+                    ss[i] = ss[i] + gc.getCoupling(i, i, ES[c], ES[c])
+    #############################################
+
+
+    O = [[[[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]],[[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]]],
+         [[[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]],[[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,0]]]]
+    ####Store Effective Rabi Couplings################
+    for c in range(0, 2):
+        for i in range(1, 4):
+                O[c][0][i][0] += gc.getCoupling(i, 0, ES[c], EP)
+                O[c][0][0][i] += np.conjugate(O[c][0][i][0])
 
+    for c1 in range(0, 2):
+        for c2 in range(0, 2):
+            for i in range(1, 4):
+                for j in range(1, 4):
+                    O[c1][c2][j][i] = gc.getCoupling(j, i, ES[c1], ES[c2])
 
+    ######################################################
 
+    det = [[0, 0, 0], [0, 0, 0]]
+    #Calculate Detuning from resonance for all States up to 2nd order stark shift#
+    for c in range(0,2):
+        for i in range(1, 4):
+            det[c][i - 1] = detBR[c] + ((ground[2] - ground[i]) + (ss[2] - ss[i]))
 
+    det = np.real(det)
+    ##############################################################################
 
 
 
+    H = []
+    HM = []
+    if op is None or (op.N_e, op.D_e, op.N_F, op.D_F) != (2, 4, modes, trunc):
+        op = operators.Operators(2, 4, modes, trunc)
 
+    #######Create Motional Hamiltonian Components (Carrier, Blue, Red Sideband)##########
+    for m in range(0, modes):
+        ld = op.lamb_dicke(m+1, eta[m], getattr(Expm, 'LD_order', 1), max_sideband = 1)
+        ####Sidebands vanishing at this eta (e.g. eta = 0) are missing and skipped####
+        HM.append([ld.get(0), ld.get(1), ld.get(-1)])
+
+    ######################################################
+
+    #####First Ion Hamiltonian#####
+    for m in range(0, modes):
+        for e in range(0, 3):
+            if HM[m][e] is None:
+                continue
+            for c in range(0, 2):
+                for i in range(0, 3):
+                    H.append([O[c][0][i + 1][0]*op.coupling([[-1, 0]], [[-1, i + 1]])*HM[m][e],
+                              det[c][i]+vibF[m][e], Phase[c]])
+
+
+    for m in range(0, modes):
+        for e in range(0, 3):
+            if HM[m][e] is None:
+                continue
+            for c in range(0, 2):
+                for i in range(0, 3):
+                    H.append([O[c][0][0][i + 1]*op.coupling([[-1, i + 1]], [[-1, 0]])*HM[m][e].dag(),
+                              -(det[c][i]+vibF[m][e]), -Phase[c]])
+
+    for c1 in range(0, 2):
+        for c0 in range(0, 2):
+            for i in range(1, 4):
+                for j in range(1, 4):
+                    if (i != j):
+                        H.append([O[c1][c0][i][j]*op.coupling([[-1, j]], [[-1, i]])*op.id(),
+                                  det[c1][i-1] - det[c0][j-1], Phase[c0] - Phase[c1]])
+
+    #######################################
+
+    ####Second Ion Hamiltonian#####
+    for m in range(0, modes):
+        for e in range(0, 3):
+            if HM[m][e] is None:
+                continue
+            for c in range(0, 2):
+                for i in range(0, 3):
+                    H.append([O[c][0][i + 1][0]*op.coupling([[0, -1]], [[i + 1, -1]])*HM[m][e],
+                              det[c][i]+vibF[m][e], Phase[c]])
+
+    for m in range(0, modes):
+        for e in range(0, 3):
+            if HM[m][e] is None:
+                continue
+            for c in range(0, 2):
+                for i in range(0, 3):
+                    H.append([O[c][0][0][i + 1]*op.coupling([[i + 1, -1]], [[0, -1]])*HM[m][e].dag(),
+                              -(det[c][i]+vibF[m][e]), -Phase[c]])
+
+    for c1 in range(0, 2):
+        for c0 in range(0, 2):
+            for i in range(1, 4):
+                for j in range(1, 4):
+                    if (i != j):
+                        H.append([O[c1][c0][i][j]*op.coupling([[j, -1]], [[i, -1]])*op.id(),
+                                  det[c1][i-1] - det[c0][j-1], Phase[c0] - Phase[c1]])
 
+    #########################################
 
+    return H
 
 
+def MQramanDynamicsBC(Expm, rwa_cutoff = None, rwa_order = 2, gc = None, op = None, floquet = False, period = None,
+                      cache = None, options = None):
 
+    """floquet = True returns the states at every period only (see floquetDynamics)
+       The report of the secular approximation (None without rwa_cutoff) is attached as .secular,
+       except to results read from the cache
+       cache is an optional diskcache.ResultCache returning stored results of identical runs;
+       floquet runs are not cached, since their result carries the propagator (.floquet)
+       options is an optional qutip Options instance of the solver"""
 
+    if (Expm.B_C and cache is not None and not floquet):
+        key = cacheKey('MQramanDynamicsBC', Expm, gc, options, rwa_cutoff, rwa_order)
+        return cache.get_or_run(key, lambda: MQramanDynamicsBC(Expm, rwa_cutoff, rwa_order, gc, op, options = options))
 
+    if (Expm.B_C):
 
-    
+        modes = Expm.N_m
+        trunc = Expm.D_f
+        tstep = Expm.tstep
+        tmax = Expm.tmax
 
+        #######Simulate Dynamics########
+        t = np.linspace(0, tmax, tstep)
+        with instrument.timer('raman.terms'):
+            terms = MQramanTermsBC(Expm, gc, op)
+        with instrument.timer('raman.coefficients'):
+            terms = merge_terms(terms)
+            ####Drop Terms Rotating Faster Than rwa_cutoff x Coupling####
+            report = None
+            if rwa_cutoff is not None:
+                terms, report = secular_approximation(terms, rwa_cutoff, rwa_order)
+        ###Start in Ground State of All Modes###
+        psi0 = tensor(basis(4, 0), basis(4, 0), tensor([basis(trunc, 0) for i in range(0, modes)]))
+        ########################################
+        if floquet:
+            sol = floquetDynamics(terms, psi0, tmax, tstep, period, options)
+            sol.secular = report
+            return sol
+
+        with instrument.timer('raman.coefficients'):
+            H = PhaseTable(t).hamiltonian(terms)
+        with instrument.timer('raman.solver'):
+            data = mesolve(H, psi0, t, [], [], options = options, progress_bar = True)
+        data.secular = report
+
+        return data
+
+    else:
+
+        print("Not Valid Bichromatic Experiment")
 
+        return None
+
+
+###########################################################################################################
 
 
 
@@ -295,4 +388,10 @@ Expm = experiment.Experiment(B_C = True, N_m = 1, D_f = 20, F_f = [3], Dets = [-
 
 
 
+if __name__ == '__main__':
 
+    ####Define Experiment####
+    Expm = experiment.Experiment(B_C = True, N_m = 1, D_f = 20, F_f = [3], Dets = [-2.85, 2.85],
+                                 F_s = [[[15000, 0, 0]], [[0, 15000, 0], [0, 15000, 0]]],
+                                 P = [0, 0], Dicke = [.1], t = 200, tstep = 40000)
+    #########################
@@ -0,0 +1,191 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+#Scaling benchmarks of operator construction, Hamiltonian assembly and time evolution
+#Run from the repository root:
+#    python benchmarks/run_benchmarks.py --output bench.json [--baseline baseline.json] [--threshold 0.25]
+#Exits with status 1 if a benchmark is slower or uses more memory than the baseline by more than threshold.
+#2017-2019
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(function, repeat=3):
+    """Return (best wall time in seconds, peak traced memory in bytes) of function() over repeat runs.
+    The memory is measured on a separate run, since tracing slows the function down.
+    """
+    times = []
+    for r in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+####Benchmarks: each takes its parameters as keyword arguments and returns the function to measure####
+
+def bench_operators(ions, fock, modes):
+    from trappedionsqsim.utils.operators import Operators
+    def run():
+        Operators(ions, 2, modes, fock, prewarm=True)
+    return run
+
+
+def bench_get_pauli(ions, fock, modes):
+    from trappedionsqsim.utils.simulations import Gate
+    gate = Gate(ions, 2, modes, fock)
+    def run():
+        gate.ops.clear_cache()
+        gate.get_pauli('X'*ions)
+    return run
+
+
+def bench_ground_coupling(calls):
+    import RamanSimBC
+    coupling = RamanSimBC.groundCoupling()
+    E1, E2 = [15000., 0., 0.], [0., 15000., 0.]
+    def run():
+        coupling._tensor = None
+        for k in range(calls):
+            coupling.getCoupling(k % 4, (k + 1) % 4, E1, E2)
+    return run
+
+
+def bench_mq_assembly(fock, modes):
+    import RamanSimBC
+    import experiment
+    Expm = experiment.Experiment(B_C = True, N_m = modes, D_f = fock, F_f = [3]*modes, Dets = [-2.85, 2.85],
+                                 F_s = [[[15000, 0, 0]], [[0, 15000, 0], [0, 15000, 0]]],
+                                 P = [0, 0], Dicke = [.1]*modes, t = 200, tstep = 40000)
+    def run():
+        RamanSimBC.merge_terms(RamanSimBC.MQramanTermsBC(Expm))
+    return run
+
+
+def bench_evolve_spline(ions, fock, steps):
+    import qutip as qtp
+    from trappedionsqsim.utils.simulations import Simulation
+    sim = Simulation(ions, 2, 1, fock)
+    t = np.linspace(0, 10, steps)
+    H = [[sum(sim.sp(i)*sim.a(1) for i in range(1, ions+1)), 0.1*np.exp(1j*0.3*t)],
+         [sum(sim.sm(i)*sim.a(1).dag() for i in range(1, ions+1)), 0.1*np.exp(-1j*0.3*t)]]
+    psi0 = qtp.tensor([qtp.basis(2, 0)]*ions + [qtp.basis(fock, 0)])
+    def run():
+        sim.reset()
+        sim.set_curr_state(psi0)
+        sim.evolve_spline(H, t, save_to_states_list=False)
+    return run
+
+
+BENCHMARKS = {
+    'operators': (bench_operators, {'ions': [1, 2, 3, 4], 'fock': [5, 10, 20], 'modes': [1, 2]}),
+    'get_pauli': (bench_get_pauli, {'ions': [1, 2, 3, 4], 'fock': [5, 10], 'modes': [1, 2]}),
+    'ground_coupling': (bench_ground_coupling, {'calls': [100, 1000]}),
+    'mq_assembly': (bench_mq_assembly, {'fock': [5, 10, 20], 'modes': [1, 2]}),
+    'evolve_spline': (bench_evolve_spline, {'ions': [1, 2, 3], 'fock': [5, 10], 'steps': [200, 1000]}),
+}
+
+QUICK = {
+    'operators': {'ions': [1, 2], 'fock': [5], 'modes': [1]},
+    'get_pauli': {'ions': [1, 2], 'fock': [5], 'modes': [1]},
+    'ground_coupling': {'calls': [100]},
+    'mq_assembly': {'fock': [5], 'modes': [1]},
+    'evolve_spline': {'ions': [1], 'fock': [5], 'steps': [200]},
+}
+
+
+def grid(axes):
+    names = sorted(axes)
+    points = [{}]
+    for name in names:
+        points = [dict(p, **{name: v}) for p in points for v in axes[name]]
+    return points
+
+
+def run_benchmarks(names, quick=False, repeat=3):
+    results = []
+    for name in names:
+        bench, axes = BENCHMARKS[name]
+        for params in grid(QUICK[name] if quick else axes):
+            elapsed, peak = measure(bench(**params), repeat)
+            results.append({'name': name, 'params': params, 'time': elapsed, 'peak_bytes': peak})
+            print("%-16s %-40s %10.4f s %12d B" % (name, json.dumps(params, sort_keys=True), elapsed, peak))
+    return results
+
+
+def environment():
+    import scipy
+    import qutip
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+            'scipy': scipy.__version__, 'qutip': qutip.__version__,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def _key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+    """Return the list of regressions: benchmarks whose time or peak memory exceeds the baseline
+    by more than the fraction threshold. Benchmarks missing from the baseline are ignored.
+    """
+    reference = dict((_key(r), r) for r in baseline['results'])
+    regressions = []
+    for r in results:
+        b = reference.get(_key(r))
+        if b is None:
+            continue
+        for field in ('time', 'peak_bytes'):
+            if b[field] > 0 and r[field] > (1 + threshold)*b[field]:
+                regressions.append((r['name'], r['params'], field, b[field], r[field]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling benchmarks of trappedionsqsim")
+    parser.add_argument('--output', default='bench.json', help='JSON file for the results')
+    parser.add_argument('--baseline', help='JSON file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative slowdown or memory growth reported as a regression')
+    parser.add_argument('--only', nargs='*', choices=sorted(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--quick', action='store_true', help='run the smallest sizes only')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs, the best is kept')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.only or sorted(BENCHMARKS), args.quick, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=1)
+    print("Results written to", args.output)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for name, params, field, before, after in regressions:
+        print("REGRESSION %s %s %s: %.4g -> %.4g (%+.0f%%)" % (name, json.dumps(params, sort_keys=True), field,
+                                                           before, after, 100*(after/before - 1)))
+    if regressions:
+        return 1
+    print("No regression above", args.threshold)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,9 +13,59 @@ class ClebschGordonCalc:
             Georgia Institute of Technology
     """""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""""
     
-    def __init__(self):
+    _tables = {}
+    
+    def __init__(self, F_max = 2):
         
         self.data = 0
+        self.F_max = F_max
+    
+    ####Lookup Table of All Coefficients up to F_max, Indexed by Doubled Quantum Numbers####
+    def table(self):
+
+        if self.F_max not in ClebschGordonCalc._tables:
+
+            n = int(round(2*self.F_max))
+            t = np.zeros([n + 1, 2*n + 1, n + 1, 2*n + 1, 3])
+
+            for f1 in range(0, n + 1):
+                for f2 in range(f1 % 2, n + 1, 2):
+                    if abs(f1 - f2) > 2:
+                        continue
+                    for m1 in range(-f1, f1 + 1, 2):
+                        for m in range(-1, 2):
+                            m2 = m1 - 2*m
+                            if abs(m2) <= f2:
+                                with np.errstate(all = 'ignore'):
+                                    c = self.CGCoeff(f1/2, m1/2, f2/2, m2/2, m)
+                                t[f1, m1 + n, f2, m2 + n, m + 1] = 0 if (c is None or np.isnan(c)) else c
+
+            ClebschGordonCalc._tables[self.F_max] = t
+
+        return ClebschGordonCalc._tables[self.F_max]
+
+    ####Vectorized Coefficients for Arrays of (f1, m1, f2, m2, m), Broadcast Against Each Other####
+    def CGCoeffs(self, f1, m1, f2, m2, m):
+
+        f1, m1, f2, m2, m = np.broadcast_arrays(*[np.asarray(x, dtype = float) for x in (f1, m1, f2, m2, m)])
+
+        F = max(np.max(f1, initial = 0), np.max(f2, initial = 0))
+        if F > self.F_max:
+            self.F_max = np.ceil(2*F)/2
+
+        n = int(round(2*self.F_max))
+        idx = [np.rint(2*x).astype(int) for x in (f1, m1, f2, m2)]
+        for x, i in zip((f1, m1, f2, m2), idx):
+            if not np.allclose(2*x, i):
+                raise ValueError("Angular momenta must be integers or half-integers")
+        if np.any(np.abs(m) > 1) or not np.allclose(m, np.rint(m)):
+            raise ValueError("m must be -1, 0 or 1")
+
+        valid = (idx[0] >= 0) & (idx[2] >= 0) & (np.abs(idx[1]) <= idx[0]) & (np.abs(idx[3]) <= idx[2])
+        out = self.table()[idx[0]*valid, (idx[1] + n)*valid, idx[2]*valid, (idx[3] + n)*valid,
+                           np.rint(m).astype(int) + 1]
+
+        return np.where(valid, out, 0.)
     
     def CGCoeff(self, f1, m1, f2, m2, m):
         
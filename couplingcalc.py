@@ -22,26 +22,20 @@ class CouplingCalc:
     ####Transforms Carteisian Vector to Spherical Basis#####
     def toSpherical(self, v):
 
-        vp = np.empty([3], dtype = complex)
-        
-        vp[0] = (v[0] + 1j*v[2])/(np.sqrt(2))
-        vp[1] = v[2]
-        vp[2] = -1*(v[0] - 1j*v[1])/(np.sqrt(2))
-        
-        return vp
-
-    ####Get Couplings Between States of m1 and m2####
-    def getCoupling(self, F2, m2, dipole):
+        return np.dot(SPHERICAL, v)
 
-        dipVec = []
+    ####Get Dipole Matrix Elements Between States of m1 and m2 for m = -1, 0, 1####
+    def dipoleVector(self, F2, m2, dipole):
 
-        for m in range(-1, 2):
-            
-            dipVec.append(dipole*self.cg.CGCoeff(self.F1, self.m1, F2, m2, m)/(np.sqrt(2*self.F1 + 1)))
-
-
-        return np.vdot(self.toSpherical(self.E), dipVec)
+        return dipole*self.cg.CGCoeffs(self.F1, self.m1, F2, m2, np.arange(-1, 2))/(np.sqrt(2*self.F1 + 1))
 
+    ####Get Couplings Between States of m1 and m2####
+    def getCoupling(self, F2, m2, dipole):
 
+        return np.vdot(self.toSpherical(self.E), self.dipoleVector(F2, m2, dipole))
 
 
+####Cartesian to Spherical Basis Transformation Matrix####
+SPHERICAL = np.array([[1/np.sqrt(2), 0, 1j/np.sqrt(2)],
+                      [0, 0, 1],
+                      [-1/np.sqrt(2), 1j/np.sqrt(2), 0]])
@@ -5,6 +5,7 @@ class Experiment:
     B_C = Boolean Identifying whether Bichromatic Field
     N_m = Number of Modes
     Dicke = Ld Parameter of Modes [eta1, eta2, ...]
+    LD_order = Order of Lamb-Dicke Expansion (None for exact exp(i*eta*(a + a^dagger)))
     D_f = Dimension of Fock Spaces Considered
     F_f = Frequency of oscillator spaces (MHz)
     Dets = Red Blue Detuning (MHz)
@@ -26,7 +27,7 @@ class Experiment:
     def __init__(self, B_C = False, N_m = 0, D_f = 0, F_f = [0], Dets = [0, 0],
                  F_s = [[[0, 0, 0]], [[0, 0, 0],[0, 0, 0]]],
                  P = 0, Dicke = [0], F_C = False, F_t = 0, S = 0, T = 0,
-                 tstep = 0, t = 0):
+                 tstep = 0, t = 0, LD_order = 1):
 
                 self.B_C = B_C
                 self.N_m = N_m
@@ -42,6 +43,7 @@ class Experiment:
                 self.T = T
                 self.tstep = tstep
                 self.tmax = t
+                self.LD_order = LD_order
 
 
 
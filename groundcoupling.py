@@ -1,6 +1,8 @@
 
 import numpy as np
 import couplingcalc
+import clebschgordon
+from trappedionsqsim.utils import instrument
 
 
 class GroundCoupling:
@@ -22,6 +24,7 @@ class GroundCoupling:
         self.fg = fg
         self.mg = mg
         self.dipole = dipole
+        self._tensor = None
     
     def intermediateRabiArray(self, i, E):
         
@@ -50,16 +53,44 @@ class GroundCoupling:
         return sum
 
 
-    def getCoupling(self, i, j, E1, E2):
+    def couplingTensor(self):
+
+        """Rank-4 tensor T[i, j, a, b] over (ground i, ground j, Cartesian field components a, b) with
+        getCoupling(i, j, E1, E2) = sum_ab conj(E1[a]) T[i, j, a, b] E2[b], built once per instance"""
+
+        if self._tensor is None:
+
+            ####Dipole Elements D[i, e, q] Between Ground i and Intermediate e####
+            fg = np.asarray(self.fg)[:, None, None]
+            mg = np.asarray(self.mg)[:, None, None]
+            fint = np.asarray(self.fint)[None, :, None]
+            mint = np.asarray(self.mint)[None, :, None]
+            m = np.arange(-1, 2)[None, None, :]
 
-        v1 = self.intermediateRabiArray(i, E1)
-        v2 = self.intermediateRabiArray(j, E2)
+            cg = clebschgordon.ClebschGordonCalc()
+            D = np.asarray(self.dipole)[None, :, None]*cg.CGCoeffs(fg, mg, fint, mint, m)/np.sqrt(2*fg + 1)
 
-        return self.intermediateSum(v1, v2)
+            ####Rabi Amplitude of Each Field Component: v[e] = sum_a conj(E[a]) A[i, e, a]####
+            A = np.einsum('qa,ieq->iea', np.conjugate(couplingcalc.SPHERICAL), D)
+            c = -1/(4*np.asarray(self.detuning, dtype = float))
 
+            self._tensor = np.einsum('e,iea,jeb->ijab', c, A, np.conjugate(A))
+
+        return self._tensor
+
+
+    @instrument.timed('groundcoupling.getCoupling')
+    def getCoupling(self, i, j, E1, E2):
 
+        return np.einsum('a,ab,b->', np.conjugate(E1), self.couplingTensor()[i, j], np.asarray(E2))
 
 
+    def getCouplings(self, E1, E2):
 
+        """Couplings between all pairs of ground states for batches of fields,
+        E1 and E2 of shape (..., 3) (broadcast against each other), returned with shape (..., n_ground, n_ground)"""
 
+        E1 = np.conjugate(np.asarray(E1))
+        E2 = np.asarray(E2)
 
+        return np.einsum('...a,ijab,...b->...ij', E1, self.couplingTensor(), E2)
@@ -14,7 +14,9 @@ config = {
     'url': 'https://github.com/trxw/trappedionsqsim',
     'version': '0.1',
     'install_requires': ['qutip', 'numpy', 'matplotlib', 'scipy'],
-    'packages': ['trappedionsqsim', 'trappedionsqsim.utils']
+    'packages': ['trappedionsqsim', 'trappedionsqsim.utils'],
+    'py_modules': ['RamanSimBC', 'experiment', 'groundcoupling', 'couplingcalc', 'clebschgordon'],
+    'entry_points': {'console_scripts': ['trappedionsqsim = trappedionsqsim.cli:main']}
 }
 
 setup(**config)
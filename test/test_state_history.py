@@ -0,0 +1,37 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import numpy as np
+import qutip as qtp
+from trappedionsqsim.utils.storage import StateHistory
+from trappedionsqsim.utils.simulations import Simulation
+
+#Decimated state history at segment and gate boundaries
+
+
+def test_extend_keeps_segment_end():
+    history = StateHistory(decimate=3)
+    states = [qtp.basis(2, k % 2) for k in range(5)]
+    history.extend(np.arange(5.), states)
+    assert list(history.times) == [0., 3., 4.]
+    history.extend(np.arange(4., 8.), states[:4], overlap=True)
+    assert list(history.times) == [0., 3., 4., 6., 7.]
+    assert history[-1] == states[3]
+
+
+def test_replace_stores_state_after_dropped_one():
+    history = StateHistory(decimate=2)
+    history.extend([0., 1., 2.], [qtp.basis(2, 0)]*3)
+    history._put(3., qtp.basis(2, 0), False, False) #dropped by the decimation
+    history.append(3., qtp.basis(2, 1), replace=True)
+    assert list(history.times) == [0., 2., 3.]
+    assert history[-1] == qtp.basis(2, 1)
+
+
+def test_gate_after_decimated_segment():
+    sim = Simulation(1, 2, 0, 0, history_decimate=2)
+    sim.set_curr_state(qtp.basis(2, 0))
+    sim.evolve_constant(None, [0, 1], 4)
+    sim.apply_gate('X')
+    assert sim.time_arr[-1] == sim.curr_t == 1
+    assert np.isclose(qtp.expect(sim.sz(1), sim.states_list[-1]), qtp.expect(sim.sz(1), sim.curr_state))
+    assert np.isclose(qtp.expect(sim.sz(1), sim.states_list[-1]), -1)
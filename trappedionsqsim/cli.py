@@ -0,0 +1,172 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+#Headless batch runner: executes the jobs of a JSON or TOML manifest on a pool of worker processes
+#and writes one .npz result per job to an output directory.
+#Heavy dependencies (numpy, qutip, the simulation modules) are only imported by the jobs that need them.
+#
+#Manifest (JSON; TOML uses the same keys):
+#{
+#  "defaults": {"runner": "RamanSimBC:MQramanDynamicsBC", "factory": "experiment:Experiment",
+#               "experiment": {"B_C": true, "N_m": 1, "D_f": 20}, "kwargs": {}},
+#  "jobs": [{"name": "eta_0.1", "experiment": {"Dicke": [0.1]}},
+#           {"name": "eta_0.2", "experiment": {"Dicke": [0.2]}, "kwargs": {"rwa_cutoff": 10}}]
+#}
+#Every job is merged into the defaults ("experiment" and "kwargs" key by key) and runs
+#runner(factory(**experiment), **kwargs), or runner(**kwargs) without "experiment".
+#2017-2019
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+import traceback
+
+from . import __version__
+
+
+def load_manifest(path):
+    """Return the manifest in path (.json or .toml) as a dictionary.
+    """
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("Reading TOML manifests requires Python 3.11 or the tomli package.")
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def expand_jobs(manifest):
+    """Return the list of jobs of a manifest, each merged into the manifest defaults and named.
+    """
+    defaults = manifest.get('defaults', {})
+    jobs = []
+    for i, job in enumerate(manifest.get('jobs', [])):
+        merged = dict(defaults)
+        merged.update(job)
+        for key in ('experiment', 'kwargs'):
+            if key in defaults or key in job:
+                merged[key] = dict(defaults.get(key, {}), **job.get(key, {}))
+        merged.setdefault('name', 'job' + str(i))
+        if 'runner' not in merged:
+            raise ValueError("Job " + merged['name'] + " has no runner.")
+        jobs.append(merged)
+    names = [job['name'] for job in jobs]
+    if len(set(names)) != len(names):
+        raise ValueError("Job names must be unique.")
+    return jobs
+
+
+def resolve(spec):
+    """Import and return the object named by spec = 'module:attribute'.
+    """
+    if ':' not in spec:
+        raise ValueError("Expected 'module:attribute', got " + repr(spec))
+    module, attribute = spec.split(':', 1)
+    obj = importlib.import_module(module)
+    for name in attribute.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def run_job(job, output):
+    """Run one job and write output/<name>.npz and output/<name>.json; return the job record.
+    """
+    start = time.time()
+    record = {'name': job['name'], 'runner': job['runner'], 'status': 'ok'}
+    try:
+        runner = resolve(job['runner'])
+        kwargs = job.get('kwargs', {})
+        if 'experiment' in job:
+            config = resolve(job.get('factory', 'experiment:Experiment'))(**job['experiment'])
+            result = runner(config, **kwargs)
+        else:
+            result = runner(**kwargs)
+        import numpy as np
+        from .utils.storage import result_arrays
+        path = os.path.join(output, job['name'] + '.npz')
+        np.savez(path + '.tmp.npz', **result_arrays(result))
+        os.replace(path + '.tmp.npz', path)
+        record['result'] = os.path.basename(path)
+    except Exception as error:
+        record['status'] = 'failed'
+        record['error'] = repr(error)
+        record['traceback'] = traceback.format_exc()
+    record['seconds'] = time.time() - start
+    with open(os.path.join(output, job['name'] + '.json'), 'w') as f:
+        json.dump(dict(record, job=job), f, indent=1)
+    return record
+
+
+def _init_worker(paths):
+    for path in reversed(paths):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='trappedionsqsim',
+                                     description="Run the simulation jobs of a JSON or TOML manifest.")
+    parser.add_argument('manifest', help='manifest file (.json or .toml)')
+    parser.add_argument('-o', '--output', default='results', help='output directory')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--only', nargs='*', help='names of the jobs to run')
+    parser.add_argument('--resume', action='store_true', help='skip jobs whose result already exists')
+    parser.add_argument('--path', action='append', default=[],
+                        help='directory added to the import path of the runners (default: the current '
+                             'directory and the directory of the manifest)')
+    parser.add_argument('--list', action='store_true', help='list the jobs and exit')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("Number of workers must be greater than or equal to 1")
+    jobs = expand_jobs(load_manifest(args.manifest))
+    if args.only:
+        jobs = [job for job in jobs if job['name'] in args.only]
+    if args.list:
+        for job in jobs:
+            print(job['name'], job['runner'])
+        return 0
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    if args.resume:
+        jobs = [job for job in jobs if not os.path.exists(os.path.join(args.output, job['name'] + '.npz'))]
+    paths = [os.path.abspath(p) for p in args.path] or \
+            [os.getcwd(), os.path.dirname(os.path.abspath(args.manifest))]
+    _init_worker(paths)
+
+    print("Running", len(jobs), "jobs on", args.workers, "workers")
+    records = []
+    if args.workers == 1:
+        for job in jobs:
+            records.append(run_job(job, args.output))
+            print(records[-1]['name'], records[-1]['status'], "%.1f s" % records[-1]['seconds'])
+    else:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(paths,)) as executor:
+            futures = [executor.submit(run_job, job, args.output) for job in jobs]
+            for future in as_completed(futures):
+                records.append(future.result())
+                print(records[-1]['name'], records[-1]['status'], "%.1f s" % records[-1]['seconds'])
+
+    failed = [r['name'] for r in records if r['status'] != 'ok']
+    with open(os.path.join(args.output, 'summary.json'), 'w') as f:
+        json.dump({'manifest': os.path.abspath(args.manifest), 'version': __version__,
+                   'jobs': sorted(records, key=lambda r: r['name'])}, f, indent=1)
+    if failed:
+        print("Failed jobs:", ", ".join(failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import qutip as qtp
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+#Block decomposition of Hamiltonians from the connectivity of their sparsity pattern
+#2017-2019
+
+
+def _operators(Hamiltonian_list):
+    return [H if isinstance(H, qtp.Qobj) else H[0] for H in Hamiltonian_list]
+
+
+def coupling_graph(Hamiltonian_list, c_ops=[]):
+    """Return the adjacency matrix of the basis states coupled by any Hamiltonian term or collapse operator.
+    """
+    ops = _operators(Hamiltonian_list) + list(c_ops)
+    if len(ops) == 0:
+        raise ValueError("Set at least one operator.")
+    graph = sp.csr_matrix(ops[0].shape, dtype=bool)
+    for op in ops:
+        pattern = sp.csr_matrix(op.data, dtype=complex)
+        pattern.eliminate_zeros()
+        pattern = pattern.astype(bool)
+        graph = graph + pattern + pattern.T
+    return graph
+
+
+def connected_blocks(Hamiltonian_list, c_ops=[]):
+    """Return (number_of_blocks, labels) where labels[i] is the invariant block of basis state i:
+    no term of Hamiltonian_list nor collapse operator connects two different blocks.
+    """
+    return connected_components(coupling_graph(Hamiltonian_list, c_ops), directed=False)
+
+
+def reachable_indices(Hamiltonian_list, state, c_ops=[]):
+    """Return the sorted indices of the basis states in the blocks touched by the support of state
+    (a ket or density matrix); the evolution never leaves their span.
+    """
+    n_blocks, labels = connected_blocks(Hamiltonian_list, c_ops)
+    data = state.full()
+    support = np.abs(data).sum(axis=1) > 0
+    return np.nonzero(np.isin(labels, np.unique(labels[support])))[0]
+
+
+def restrict(op, indices):
+    """Return the operator or state restricted to the basis states indices.
+    """
+    data = sp.csr_matrix(op.data)
+    if op.isket:
+        return qtp.Qobj(data[indices, :])
+    if op.isbra:
+        return qtp.Qobj(data[:, indices])
+    return qtp.Qobj(data[indices, :][:, indices])
+
+
+def restrict_list(Hamiltonian_list, indices):
+    """Restrict every operator of a [H0, [H1, f1], ...] list, keeping the coefficients.
+    """
+    return [restrict(H, indices) if isinstance(H, qtp.Qobj) else [restrict(H[0], indices)] + list(H[1:])
+            for H in Hamiltonian_list]
+
+
+def embed(state, indices, dims):
+    """Return the ket or density matrix of a block embedded back in the full space with the given dims.
+    """
+    n = int(np.prod(dims[0]))
+    data = state.full()
+    if state.isket:
+        full = np.zeros((n, 1), dtype=complex)
+        full[indices, 0] = data[:, 0]
+    else:
+        full = np.zeros((n, n), dtype=complex)
+        full[np.ix_(indices, indices)] = data
+    return qtp.Qobj(full, dims=dims)
@@ -0,0 +1,109 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+from collections import OrderedDict
+
+#A small bounded memoization container shared by the operator and propagator caches
+#2017-2019
+
+
+class LRUCache(object):
+    """
+    Least-recently-used cache bounded by the number of entries and/or by the total size in bytes
+    of the stored values.
+    max_entries = maximum number of stored values (None for unbounded)
+    max_bytes = maximum total size of stored values in bytes (None for unbounded)
+    sizeof = function returning the size in bytes of a stored value
+    """
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None):
+        if max_entries is not None and max_entries < 0:
+            raise ValueError("max_entries must be greater than or equal to 0")
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError("max_bytes must be greater than or equal to 0")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof if sizeof is not None else (lambda value: 0)
+        self._data = OrderedDict()
+        self._sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Return the value stored under key and mark it as most recently used.
+        Counts a hit or a miss.
+        """
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Store value under key, evicting least recently used values to respect the bounds.
+        A value larger than max_bytes is not stored.
+        """
+        size = self.sizeof(value)
+        if key in self._data:
+            self._remove(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return value
+        if self.max_entries == 0:
+            return value
+        self._data[key] = value
+        self._sizes[key] = size
+        self.nbytes += size
+        self._evict()
+        return value
+
+    def get_or_build(self, key, builder):
+        """Return the value stored under key, calling builder() and storing its result on a miss.
+        """
+        if key in self._data:
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key]
+        self.misses += 1
+        return self.put(key, builder())
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.nbytes = 0
+
+    def info(self):
+        """Return a dictionary of cache statistics.
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._data),
+                'nbytes': self.nbytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes}
+
+    def _remove(self, key):
+        del self._data[key]
+        self.nbytes -= self._sizes.pop(key)
+
+    def _evict(self):
+        while self._data and (
+                (self.max_entries is not None and len(self._data) > self.max_entries) or
+                (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.evictions += 1
+
+
+def qobj_nbytes(op):
+    """Return the memory footprint in bytes of the sparse data of a qutip object.
+    """
+    data = op.data
+    return data.data.nbytes + data.indices.nbytes + data.indptr.nbytes
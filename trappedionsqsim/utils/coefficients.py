@@ -0,0 +1,58 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import numpy as np
+
+#Array-valued time dependence for qutip Hamiltonians of the form [[H, coefficient], ...]
+#2017-2019
+
+
+class PhaseTable(object):
+    """
+    Shared tables of exp(1j*w*t) sampled on a fixed time grid, one per distinct frequency w.
+    The arrays can be used directly as qutip coefficients, which avoids compiling string
+    coefficients such as 'exp(1j*(w*t + phi))' and keeps full floating point precision.
+    params
+    tlist = time grid of the simulation; the same grid must be passed to the solver
+    """
+    def __init__(self, tlist):
+        self.tlist = np.asarray(tlist, dtype=float)
+        self._tables = {}
+
+    def __len__(self):
+        return len(self._tables)
+
+    def table(self, w):
+        """Return exp(1j*w*t) on the time grid. The array is shared between calls and must not be modified.
+        """
+        w = float(w)
+        if w not in self._tables:
+            table = np.exp(1j*w*self.tlist)
+            table.flags.writeable = False
+            self._tables[w] = table
+        return self._tables[w]
+
+    def coefficient(self, w, phi=0.):
+        """Return exp(1j*(w*t + phi)) on the time grid.
+        """
+        if phi == 0:
+            return self.table(w)
+        return np.exp(1j*phi)*self.table(w)
+
+    def hamiltonian(self, terms):
+        """
+        params
+        terms is a list of frequency-tagged terms [[H1, w1, phi1], [H2, w2, phi2], ...]
+        representing sum_k H_k exp(1j*(w_k*t + phi_k))
+        return the qutip list [[H1', table(w1)], ...] where each phase is folded into its operator,
+        H_k' = exp(1j*phi_k) H_k, so terms with equal frequency share a single coefficient array.
+        Terms with w = 0 are returned as constant operators.
+        """
+        H = []
+        for op, w, phi in terms:
+            if phi != 0:
+                op = np.exp(1j*phi)*op
+            if w == 0:
+                H.append(op)
+            else:
+                H.append([op, self.table(w)])
+        return H
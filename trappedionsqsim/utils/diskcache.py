@@ -0,0 +1,207 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import hashlib
+import json
+import os
+import time
+import zipfile
+import qutip as qtp
+import numpy as np
+from .storage import result_arrays, result_from_arrays
+from .localops import LocalOperator, materialize
+from .propagators import _hash_operator, _FUNCTIONS
+try:
+    import fcntl
+except ImportError: #not available on Windows, where stats.json updates are not locked
+    fcntl = None
+
+#Persistent content-addressed cache of simulation results, shareable between sessions and users
+#2017-2019
+
+
+def _canonical(obj):
+    """Return a JSON-serializable canonical form of obj for hashing. Operators are hashed on their sparse data
+    as in propagators.hamiltonian_hash; functions raise ValueError, since a hash would not follow their code.
+    """
+    if isinstance(obj, dict):
+        return dict((str(k), _canonical(v)) for k, v in sorted(obj.items(), key=lambda item: str(item[0])))
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return {'ndarray': hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest(),
+                'dtype': str(obj.dtype), 'shape': list(obj.shape)}
+    if isinstance(obj, (qtp.Qobj, LocalOperator)):
+        h = hashlib.sha256()
+        _hash_operator(h, materialize(obj))
+        return {'Qobj': h.hexdigest()}
+    if isinstance(obj, (complex, np.complexfloating)):
+        return [repr(float(obj.real)), repr(float(obj.imag))]
+    if isinstance(obj, (float, np.floating)):
+        return repr(float(obj))
+    if isinstance(obj, (bool, np.bool_)):
+        return bool(obj)
+    if isinstance(obj, (int, np.integer)):
+        return int(obj)
+    if obj is None or isinstance(obj, str):
+        return obj
+    if isinstance(obj, _FUNCTIONS):
+        raise ValueError("Function " + repr(obj) + " cannot be part of a cache key; use arrays or strings.")
+    if hasattr(obj, '__dict__'):
+        #configuration objects such as experiment.Experiment or qutip Options; private caches are skipped
+        return {type(obj).__name__: _canonical(dict((k, v) for k, v in vars(obj).items()
+                                                    if not k.startswith('_')))}
+    return repr(obj)
+
+
+def result_key(*parts, **named):
+    """Return the SHA-256 hex digest of the canonical form of parts and named, together with the versions
+    of this library and of qutip; equal configurations give equal keys across sessions and machines.
+    """
+    from .. import __version__
+    content = {'parts': _canonical(list(parts)), 'named': _canonical(named),
+               'version': __version__, 'qutip': qtp.__version__}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Solver results stored as compressed .npz files in directory, one per key (see result_key).
+    When the total size exceeds max_bytes the least recently used files (oldest modification time,
+    refreshed on every hit) are deleted. Hit, miss and eviction counts and the compute time saved by hits
+    are accumulated in directory/stats.json across sessions.
+    params
+    directory = cache directory, created if needed; it can be shared between users
+    max_bytes = size limit of the cache (None for unbounded)
+    """
+    def __init__(self, directory, max_bytes=None):
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError("max_bytes must be greater than or equal to 0")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.session = {'hits': 0, 'misses': 0, 'evictions': 0, 'saved_seconds': 0.}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Return the result stored under key as a qutip Result, or None on a miss.
+        A damaged entry counts as a miss and is deleted.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = dict((k, data[k]) for k in data.files)
+            result = result_from_arrays(dict((k, v) for k, v in arrays.items() if k != '_seconds'))
+        except (IOError, OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._count(misses=1)
+            return None
+        os.utime(path, None)
+        self._count(hits=1, saved_seconds=float(arrays.get('_seconds', 0.)))
+        return result
+
+    def put(self, key, result, seconds=0.):
+        """Store result (a solver result) under key; seconds is the compute time it took.
+        """
+        path = self._path(key)
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, _seconds=np.array(seconds), **result_arrays(result))
+        os.replace(tmp, path)
+        self._evict()
+
+    def get_or_run(self, key, function):
+        """Return the result stored under key, or run function(), store and return its result.
+        """
+        result = self.get(key)
+        if result is not None:
+            return result
+        start = time.time()
+        result = function()
+        self.put(key, result, time.time() - start)
+        return result
+
+    def entries(self):
+        """Return the list of (path, size in bytes, modification time) of the stored results.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for path, size, mtime in entries)
+        evicted = 0
+        while entries and total > self.max_bytes:
+            path, size, mtime = entries.pop(0)
+            try:
+                os.remove(path)
+                evicted += 1
+            except OSError:
+                pass
+            total -= size
+        if evicted:
+            self._count(evictions=evicted)
+
+    def clear(self):
+        for path, size, mtime in self.entries():
+            os.remove(path)
+
+    def _stats_path(self):
+        return os.path.join(self.directory, 'stats.json')
+
+    def _load_stats(self):
+        try:
+            with open(self._stats_path()) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {'hits': 0, 'misses': 0, 'evictions': 0, 'saved_seconds': 0.}
+
+    def _count(self, **increments):
+        for name, value in increments.items():
+            self.session[name] += value
+        #read-modify-write under an exclusive lock, so that processes sharing the directory keep all counts
+        with open(self._stats_path() + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                stats = self._load_stats()
+                for name, value in increments.items():
+                    stats[name] = stats.get(name, 0) + value
+                tmp = self._stats_path() + '.' + str(os.getpid()) + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(stats, f)
+                os.replace(tmp, self._stats_path())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def info(self):
+        """Return the cache statistics: this session's counts ('session') and the counts accumulated in
+        the directory ('total'), each with its hit rate, and the number and size of the stored results.
+        """
+        def rate(stats):
+            n = stats['hits'] + stats['misses']
+            return dict(stats, hit_rate=stats['hits']/n if n else 0.)
+        entries = self.entries()
+        return {'session': rate(dict(self.session)), 'total': rate(self._load_stats()),
+                'entries': len(entries), 'nbytes': sum(size for path, size, mtime in entries),
+                'max_bytes': self.max_bytes}
@@ -0,0 +1,110 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import copy
+import qutip as qtp
+import numpy as np
+from scipy import linalg
+from .coefficients import PhaseTable
+
+#Stroboscopic evolution of periodic Hamiltonians from their one-period propagator
+#2017-2019
+
+
+def period_propagator(terms, period, t0=0., n_steps=1000, options=None):
+    """
+    params
+    terms is a list of frequency-tagged terms [[H1, w1, phi1], [H2, w2, phi2], ...] with a common period
+    period is the period of the Hamiltonian
+    t0 is the start of the period
+    n_steps is the number of time steps of the integration grid over one period
+    options is an optional qutip Options instance (default: atol=1e-10, rtol=1e-8)
+    return the unitary U(t0 + period, t0), obtained by integrating the identity over one period
+    """
+    if period <= 0:
+        raise ValueError("period must be positive")
+    if n_steps < 2:
+        raise ValueError("n_steps must be at least 2")
+    t = np.linspace(t0, t0 + period, n_steps)
+    H = PhaseTable(t).hamiltonian(terms)
+    options = copy.copy(options) if options is not None else qtp.Options(atol=1e-10, rtol=1e-8)
+    options.store_states, options.store_final_state = False, True
+    identity = qtp.qeye(terms[0][0].dims[0])
+    return qtp.sesolve(H, identity, t, [], options=options).final_state
+
+
+class FloquetPropagator(object):
+    """
+    One-period propagator U of a periodic Hamiltonian, giving the state after any number of periods.
+    The Schur decomposition U = Z diag(exp(-1j*eps*period)) Z^dagger (Z unitary since U is normal) is computed
+    once, after which U^n costs the same for every n; eps are the quasi-energies.
+    If U is not unitary within tol (non-Hermitian Hamiltonian terms, loose solver tolerances), the Schur form 
+    is not diagonal and is not used: powers are computed by repeated products (unitary = False).
+    params
+    U is the one-period propagator as a qutip operator or array
+    period is the period of the Hamiltonian
+    t0 is the time at which the period starts
+    tol is the tolerance on ||U^dagger U - I|| and on the off-diagonal part of the Schur form
+    """
+    def __init__(self, U, period, t0=0., tol=1e-4):
+        self.dims = U.dims if isinstance(U, qtp.Qobj) else None
+        self.U = U.full() if isinstance(U, qtp.Qobj) else np.asarray(U, dtype=complex)
+        self.period = period
+        self.t0 = t0
+        T, self.Z = linalg.schur(self.U, output='complex')
+        self.unitarity_error = linalg.norm(np.dot(self.U.conj().T, self.U) - np.eye(len(self.U)))
+        self.normality_error = linalg.norm(T - np.diag(np.diag(T)))
+        self.unitary = self.unitarity_error <= tol and self.normality_error <= tol
+        #removing the solver's small loss of unitarity keeps high powers bounded
+        self.phases = np.diag(T)/np.abs(np.diag(T))
+
+    def quasienergies(self):
+        """Return the quasi-energies in (-pi/period, pi/period].
+        """
+        if not self.unitary:
+            raise ValueError("One-period propagator is not unitary (error " + str(self.unitarity_error) + ").")
+        return -np.angle(self.phases)/self.period
+
+    def power(self, n):
+        """Return U^n as a qutip operator.
+        """
+        if not self.unitary:
+            return qtp.Qobj(np.linalg.matrix_power(self.U, n), dims=self.dims)
+        return qtp.Qobj(np.dot(self.Z*self.phases**n, self.Z.conj().T), dims=self.dims)
+
+    def stroboscopic(self, state, n_periods, method='eigen'):
+        """
+        params
+        state is the ket or density matrix at t0
+        n_periods is an integer or an array of integers
+        method = 'eigen' uses the Schur decomposition, 'repeat' applies U repeatedly (exact for few periods);
+                 'eigen' falls back to 'repeat' if U is not unitary
+        return the list of states at t0 + n*period for every n in n_periods
+        """
+        ns = np.atleast_1d(n_periods).astype(int)
+        if np.any(ns < 0):
+            raise ValueError("Number of periods must be non-negative.")
+        data = state.full()
+        if method == 'eigen' and not self.unitary:
+            method = 'repeat'
+        if method == 'eigen':
+            components = np.dot(self.Z.conj().T, data)
+            if state.isket:
+                mats = [np.dot(self.Z, self.phases[:, None]**n*components) for n in ns]
+            else:
+                mats = []
+                for n in ns:
+                    p = self.phases**n
+                    mats.append(np.dot(np.dot(self.Z, p[:, None]*np.dot(components, self.Z)*p.conj()[None, :]),
+                                       self.Z.conj().T))
+        elif method == 'repeat':
+            mats, current, done = [None]*len(ns), data, 0
+            for k in np.argsort(ns, kind='stable'):
+                while done < ns[k]:
+                    current = np.dot(self.U, current)
+                    if not state.isket:
+                        current = np.dot(current, self.U.conj().T)
+                    done += 1
+                mats[k] = current
+        else:
+            raise ValueError("method must be 'eigen' or 'repeat'")
+        return [qtp.Qobj(m, dims=state.dims) for m in mats]
@@ -0,0 +1,275 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import qutip as qtp
+import numpy as np
+import scipy.sparse as sp
+from fractions import Fraction
+from functools import reduce
+from math import gcd
+
+#Compilation passes over time-dependent Hamiltonians given as [[H1, f1], [H2, f2], ...] lists
+#or as frequency-tagged term lists [[H1, w1, phi1], [H2, w2, phi2], ...] = sum_k H_k exp(1j*(w_k*t + phi_k))
+#2017-2019
+
+
+def is_zero(op, atol=0.):
+    """Return True if every matrix element of op has magnitude at most atol.
+    """
+    data = op.data.data if isinstance(op, qtp.Qobj) else np.asarray(op)
+    return data.size == 0 or np.abs(data).max() <= atol
+
+
+def merge_terms(terms, tol=1e-9, atol=0.):
+    """
+    params
+    terms is a list of frequency-tagged terms [[H1, w1, phi1], [H2, w2, phi2], ...]
+    tol is the largest frequency difference for two terms to share a group
+    atol is the magnitude below which a summed operator is considered zero and dropped
+    return an equivalent list with one term per distinct frequency: the phases are folded into
+    the operators, sum_k exp(1j*phi_k) H_k, and the group frequency is the mean of its members.
+    """
+    merged = []
+    group, ws = None, []
+    for op, w, phi in sorted(terms, key=lambda term: term[1]):
+        op = np.exp(1j*phi)*op if phi != 0 else op
+        if group is not None and abs(w - ws[0]) <= tol:
+            group = group + op
+            ws.append(w)
+            continue
+        if group is not None:
+            merged.append([group, np.mean(ws), 0.])
+        group, ws = op, [w]
+    if group is not None:
+        merged.append([group, np.mean(ws), 0.])
+    return [term for term in merged if not is_zero(term[0], atol)]
+
+
+def _coefficient_key(f, groups, rtol):
+    """Return a hashable key identifying coefficient f; arrays equal within rtol share a key.
+    """
+    if isinstance(f, str):
+        return ('str', f.replace(' ', ''))
+    if isinstance(f, np.ndarray):
+        for key, g in groups:
+            if g is f or (isinstance(g, np.ndarray) and g.shape == f.shape
+                          and np.allclose(g, f, rtol=rtol, atol=0.)):
+                return key
+        return ('array', len(groups))
+    return ('object', id(f))
+
+
+def compile_hamiltonian(Hamiltonian_list, rtol=1e-12, atol=0.):
+    """
+    params
+    Hamiltonian_list is a qutip list [H0, [H1, f1], [H2, f2], ...] as consumed by Simulation.evolve_spline
+    rtol is the relative tolerance for two coefficient arrays to be treated as identical
+    atol is the magnitude below which a summed operator is considered zero and dropped
+    return an equivalent list where all operators sharing a coefficient (the same string, the same
+    function or spline object, or equal arrays) are summed into one sparse matrix, constant
+    operators are summed into one term, and zero operators are removed.
+    """
+    constant = None
+    groups = []
+    summed = {}
+    for H in Hamiltonian_list:
+        if isinstance(H, qtp.Qobj):
+            constant = H if constant is None else constant + H
+            continue
+        op, f = H[0], H[1]
+        key = _coefficient_key(f, groups, rtol)
+        if key in summed:
+            summed[key] = summed[key] + op
+        else:
+            groups.append((key, f))
+            summed[key] = op
+
+    compiled = []
+    if constant is not None and not is_zero(constant, atol):
+        compiled.append(constant)
+    for key, f in groups:
+        if not is_zero(summed[key], atol):
+            compiled.append([summed[key], f])
+    return compiled
+
+
+def norm_bound(op):
+    """Return an upper bound on the spectral norm of op, sqrt(||op||_1 * ||op||_inf),
+    computed from absolute row and column sums of the sparse data.
+    """
+    data = abs(sp.csr_matrix(op.data if isinstance(op, qtp.Qobj) else op))
+    if data.nnz == 0:
+        return 0.
+    return float(np.sqrt(data.sum(axis=0).max() * data.sum(axis=1).max()))
+
+
+def secular_approximation(terms, cutoff, order=2, tol=1e-9):
+    """
+    Rotating-wave (secular) approximation of a frequency-tagged Hamiltonian.
+    A term A_k exp(1j*w_k*t) is fast, and removed, when |w_k| > cutoff * ||A_k||.
+    With order=2 the removed terms are folded back in through the second-order effective Hamiltonian
+        H_eff = -1/4 sum_{j,k fast} (1/w_k - 1/w_j) [A_j, A_k] exp(1j*(w_j + w_k)*t)
+    keeping only the pairs whose combined frequency is itself slow (e.g. AC Stark shifts, w_j = -w_k).
+    params
+    terms is a list of frequency-tagged terms [[H1, w1, phi1], [H2, w2, phi2], ...]
+    cutoff is the ratio of frequency to coupling strength above which a term is removed
+    order = 1 drops fast terms, order = 2 adds their effective second-order couplings
+    tol is the frequency tolerance used to merge terms
+    return (terms, report) where report is a dictionary with the number of kept, dropped and effective
+    terms, the largest dropped frequency and error estimates:
+        'micromotion': sum_k ||A_k||/|w_k| over dropped terms, the amplitude of the neglected fast oscillation
+        'drift_rate': rate at which the neglected secular dynamics accumulate an error
+                      (||H_eff|| for order = 1, third-order estimate for order = 2)
+    """
+    if order not in (1, 2):
+        raise ValueError("order must be 1 or 2")
+    if cutoff <= 0:
+        raise ValueError("cutoff must be positive")
+
+    kept, fast = [], []
+    for op, w, phi in merge_terms(terms, tol):
+        strength = norm_bound(op)
+        if w != 0 and abs(w) > cutoff*strength:
+            fast.append((op, w, strength))
+        else:
+            kept.append([op, w, phi])
+
+    effective = []
+    for j, (A_j, w_j, s_j) in enumerate(fast):
+        for k, (A_k, w_k, s_k) in enumerate(fast):
+            if k <= j:
+                continue
+            w = w_j + w_k
+            #the (j, k) and (k, j) contributions are equal, hence -1/2 instead of -1/4
+            C = -0.5*(1./w_k - 1./w_j)*(A_j*A_k - A_k*A_j)
+            strength = norm_bound(C)
+            if strength > 0 and (w == 0 or abs(w) <= cutoff*strength):
+                effective.append([C, w, 0.])
+
+    micromotion = sum(s/abs(w) for op, w, s in fast)
+    drift = norm_bound(sum(term[0] for term in effective)) if effective else 0.
+    report = {'n_kept': len(kept),
+              'n_dropped': len(fast),
+              'n_effective': len(effective),
+              'max_dropped_frequency': max([abs(w) for op, w, s in fast]) if fast else 0.,
+              'micromotion': micromotion,
+              'drift_rate': drift if order == 1 else micromotion**2*max([s for op, w, s in fast] + [0.])}
+
+    if order == 2:
+        kept = merge_terms(kept + effective, tol)
+    return kept, report
+
+
+def detect_period(terms, rtol=1e-6, max_denominator=100):
+    """
+    params
+    terms is a list of frequency-tagged terms [[H1, w1, phi1], [H2, w2, phi2], ...]
+    rtol is the largest relative error allowed when approximating the frequency ratios by fractions
+    max_denominator is the largest denominator of these fractions
+    return the common period 2*pi/w0 of all terms, with w0 the largest frequency of which every |w_k| is an
+    integer multiple, or None if the frequencies are not commensurate within rtol or all zero
+    """
+    ws = sorted(set(abs(float(w)) for op, w, phi in terms if w != 0))
+    if len(ws) == 0:
+        return None
+    ratios = [Fraction(w/ws[0]).limit_denominator(max_denominator) for w in ws]
+    for w, r in zip(ws, ratios):
+        if abs(float(r)*ws[0] - w) > rtol*w:
+            return None
+    denominator = reduce(lambda a, b: a*b//gcd(a, b), [r.denominator for r in ratios])
+    return 2*np.pi*denominator/ws[0]
+
+
+_STRING_NAMESPACE = {'exp': np.exp, 'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'sqrt': np.sqrt,
+                     'pi': np.pi, 'abs': np.abs, 'real': np.real, 'imag': np.imag, 'conj': np.conj,
+                     'sinh': np.sinh, 'cosh': np.cosh, 'tanh': np.tanh, 'log': np.log}
+
+
+def coefficient_samples(f, t1, t2, n_probe=2001, args={}):
+    """
+    Sample a qutip coefficient on [t1, t2].
+    f is a string in t, a function f(t, args) or f(t) (e.g. a qutip Cubic_Spline), or an array,
+    which is assumed to be sampled uniformly on [t1, t2].
+    return (t, values)
+    """
+    if isinstance(f, np.ndarray):
+        return np.linspace(t1, t2, len(f)), np.asarray(f, dtype=complex)
+    t = np.linspace(t1, t2, n_probe)
+    if isinstance(f, str):
+        namespace = dict(_STRING_NAMESPACE)
+        namespace.update(args)
+        namespace['t'] = t
+        values = eval(f, {'__builtins__': {}}, namespace)
+    else:
+        try:
+            values = np.array([f(x, args) for x in t])
+        except TypeError:
+            values = np.array([f(x) for x in t])
+    return t, np.broadcast_to(np.asarray(values, dtype=complex), t.shape)
+
+
+def coefficient_frequency(t, values):
+    """Return an estimate of the fastest angular frequency of a sampled coefficient: the larger of its
+    instantaneous phase velocity and its relative rate of change of amplitude.
+    """
+    amplitude = np.abs(values)
+    scale = amplitude.max()
+    if scale == 0 or len(t) < 2:
+        return 0.
+    dt = np.diff(t)
+    significant = (amplitude[1:] > 1e-3*scale) & (amplitude[:-1] > 1e-3*scale)
+    phase_rate = np.abs(np.diff(np.unwrap(np.angle(values))))/dt
+    amplitude_rate = np.abs(np.diff(amplitude))/dt/scale
+    rates = np.maximum(np.where(significant, phase_rate, 0.), amplitude_rate)
+    return float(rates.max())
+
+
+def max_frequency(Hamiltonian_list, t1, t2, n_probe=2001, args={}):
+    """
+    Upper estimate of the fastest angular frequency in the dynamics generated by Hamiltonian_list on [t1, t2]:
+    the bound sum_k ||H_k|| max|f_k| on the energy scale of H(t) plus the fastest coefficient frequency.
+    """
+    energy, oscillation = 0., 0.
+    for H in Hamiltonian_list:
+        if isinstance(H, qtp.Qobj):
+            energy += norm_bound(H)
+            continue
+        t, values = coefficient_samples(H[1], t1, t2, n_probe, args)
+        energy += norm_bound(H[0])*np.abs(values).max()
+        oscillation = max(oscillation, coefficient_frequency(t, values))
+    return energy + oscillation
+
+
+def auto_time_grid(Hamiltonian_list, t1, t2, accuracy=1e-3, n_probe=2001, args={}):
+    """
+    Choose the coarsest output grid and solver settings resolving the dynamics of Hamiltonian_list on [t1, t2].
+    With w the max_frequency bound, the output step h = sqrt(8*accuracy)/w keeps the linear interpolation error
+    of an oscillation at w, (w*h)^2/8, below accuracy. The solver tolerances are accuracy divided by the number
+    of output steps, since local errors accumulate, and its maximal internal step is pi/w, so no oscillation
+    is stepped over.
+    return (t_arr, options) with options a qutip Options instance
+    """
+    if not t2 > t1:
+        raise ValueError("Final time must be larger than initial time.")
+    if not 0 < accuracy < 1:
+        raise ValueError("accuracy must be between 0 and 1")
+    w = max_frequency(Hamiltonian_list, t1, t2, n_probe, args)
+    if w == 0:
+        return np.array([t1, t2], dtype=float), qtp.Options(atol=accuracy*1e-2, rtol=accuracy)
+    h = np.sqrt(8*accuracy)/w
+    n_steps = max(2, int(np.ceil((t2 - t1)/h)) + 1)
+    options = qtp.Options(atol=accuracy*1e-2/n_steps, rtol=accuracy/n_steps, max_step=np.pi/w,
+                          nsteps=max(1000, int(10*(t2 - t1)*w)))
+    return np.linspace(t1, t2, n_steps), options
+
+
+def resample_coefficients(Hamiltonian_list, t1, t2, t_arr):
+    """Interpolate array coefficients, assumed sampled uniformly on [t1, t2], onto the grid t_arr.
+    """
+    resampled = []
+    for H in Hamiltonian_list:
+        if isinstance(H, list) and isinstance(H[1], np.ndarray) and len(H[1]) != len(t_arr):
+            t_old = np.linspace(t1, t2, len(H[1]))
+            f = np.interp(t_arr, t_old, H[1].real) + 1j*np.interp(t_arr, t_old, H[1].imag)
+            H = [H[0], f] + list(H[2:])
+        resampled.append(H)
+    return resampled
@@ -0,0 +1,167 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import json
+import os
+import time
+from functools import wraps
+
+#Lightweight named timers, counters and per-step hooks for profiling simulations.
+#Everything is a no-op until enable() is called, apart from registered hooks.
+#2017-2019
+
+
+_ENABLED = [False]
+_TRACE = [False]
+_timers = {}
+_counters = {}
+_events = []
+_hooks = []
+
+
+def enable(trace=False):
+    """Start collecting timers and counters; trace=True also records every timed interval for export_trace.
+    """
+    _ENABLED[0] = True
+    _TRACE[0] = trace
+
+
+def disable():
+    _ENABLED[0] = False
+    _TRACE[0] = False
+
+
+def enabled():
+    return _ENABLED[0]
+
+
+def reset():
+    """Forget all collected timers, counters and trace events.
+    """
+    _timers.clear()
+    _counters.clear()
+    del _events[:]
+
+
+def count(name, n=1):
+    """Add n to the counter name.
+    """
+    if _ENABLED[0]:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class _Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        entry = _timers.get(self.name)
+        if entry is None:
+            _timers[self.name] = [1, elapsed, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+        if _TRACE[0]:
+            _events.append((self.name, self.start, elapsed))
+        return False
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    """Context manager accumulating the wall time spent in its block under name:
+        with instrument.timer('solver'):
+            ...
+    """
+    return _Timer(name) if _ENABLED[0] else _NULL_TIMER
+
+
+def timed(name):
+    """Decorator timing every call of a function under name.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED[0]:
+                return function(*args, **kwargs)
+            with _Timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_hook(hook):
+    """Register hook(t, state), called at every output time step of Simulation evolutions.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def has_hooks():
+    return len(_hooks) > 0
+
+
+def step(t, state):
+    """Call the registered hooks for the state at output time t.
+    """
+    for hook in _hooks:
+        hook(t, state)
+
+
+def stats():
+    """Return a dictionary {'timers': {name: {'count', 'total', 'mean', 'max'}}, 'counters': {name: value}}.
+    """
+    timers = dict((name, {'count': c, 'total': total, 'mean': total/c, 'max': longest})
+                  for name, (c, total, longest) in _timers.items())
+    return {'timers': timers, 'counters': dict(_counters)}
+
+
+def report():
+    """Print the timers, longest total first, and the counters.
+    """
+    s = stats()
+    for name, t in sorted(s['timers'].items(), key=lambda item: -item[1]['total']):
+        print("%-32s %8d calls %12.6f s total %12.6f s mean" % (name, t['count'], t['total'], t['mean']))
+    for name, value in sorted(s['counters'].items()):
+        print("%-32s %12d" % (name, value))
+
+
+def export_json(path):
+    """Write stats() to path as JSON.
+    """
+    with open(path, 'w') as f:
+        json.dump(stats(), f, indent=1)
+
+
+def export_trace(path):
+    """Write the intervals recorded with enable(trace=True) in the Chrome trace event format,
+    viewable in chrome://tracing or Perfetto.
+    """
+    pid = os.getpid()
+    events = [{'name': name, 'ph': 'X', 'ts': start*1e6, 'dur': elapsed*1e6, 'pid': pid, 'tid': 0}
+              for name, start, elapsed in _events]
+    events += [{'name': name, 'ph': 'C', 'ts': 0, 'pid': pid, 'args': {name: value}}
+               for name, value in _counters.items()]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,65 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import qutip as qtp
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import expm_multiply
+from .localops import materialize
+
+#Evolution under time-independent Hamiltonians from the action of exp(-iHt) on the state,
+#without building the propagator
+#2017-2019
+
+
+def generator(H, state, c_ops=[]):
+    """Return the sparse generator G of d/dt v = G v: -1j*H for a ket, the Liouvillian acting on the
+    column-stacked density matrix for a density matrix or when c_ops are given.
+    """
+    H = materialize(H)
+    if state.isket and len(c_ops) == 0:
+        return sp.csr_matrix(-1j*H.data)
+    return sp.csr_matrix(qtp.liouvillian(H, [materialize(c) for c in c_ops]).data)
+
+
+def propagate_constant(H, state, times, c_ops=[]):
+    """
+    params
+    H is a time-independent Hamiltonian (None for no evolution)
+    state is the ket or density matrix at times[0]
+    times is an increasing array of times
+    c_ops is an optional list of collapse operators; the density matrix is then evolved
+    return the list of states at times.
+    On a uniform grid all output times are obtained in a single expm_multiply call, which reuses its
+    norm estimates and Taylor steps from one output time to the next; otherwise each interval is propagated
+    from the previous output.
+    """
+    times = np.asarray(times, dtype=float)
+    if len(times) < 1:
+        raise ValueError("Set at least one time.")
+    if H is None and len(c_ops) == 0:
+        return [state]*len(times)
+    if H is None:
+        H = qtp.qzero(state.dims[0])
+
+    is_ket = state.isket and len(c_ops) == 0
+    if is_ket:
+        v = state.full().ravel()
+    else:
+        rho = state if state.isoper else qtp.ket2dm(state)
+        v = qtp.operator_to_vector(rho).full().ravel()
+    G = generator(H, state, c_ops)
+
+    steps = np.diff(times)
+    if len(times) == 1:
+        vs = v[None, :]
+    elif np.allclose(steps, steps[0]):
+        vs = expm_multiply(G, v, start=0., stop=times[-1] - times[0], num=len(times), endpoint=True)
+    else:
+        vs = [v]
+        for dt in steps:
+            vs.append(expm_multiply(G*dt, vs[-1]))
+
+    if is_ket:
+        return [qtp.Qobj(x[:, None], dims=state.dims) for x in vs]
+    vec_dims = [rho.dims, [1]]
+    return [qtp.vector_to_operator(qtp.Qobj(x[:, None], dims=vec_dims)) for x in vs]
@@ -0,0 +1,158 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import numbers
+import qutip as qtp
+import numpy as np
+import scipy.sparse as sp
+
+#Factored (Kronecker-structured) operators on a tensor product Hilbert space
+#2017-2019
+
+
+class LocalOperator(object):
+    """
+    Lazy operator on a tensor product space stored as a sum of products of single-site factors,
+        O = sum_k c_k (x)_{site in term k} F_{k,site}
+    with the identity on every site not listed in a term. The full matrix is never built
+    unless to_sparse() or to_qobj() is called.
+    params
+    dims = list of the dimensions of each site, e.g. [D_e]*N_e + [D_F]*N_F
+    terms = list of (coefficient, {site_index: factor}) pairs, site_index = 0, 1, ... len(dims)-1
+    """
+    def __init__(self, dims, terms=()):
+        self.dims = list(dims)
+        self.terms = []
+        for c, factors in terms:
+            checked = {}
+            for site, f in factors.items():
+                f = np.asarray(f.full() if isinstance(f, qtp.Qobj) else f, dtype=complex)
+                if not 0 <= site < len(self.dims):
+                    raise ValueError("Site index must be between 0 and " + str(len(self.dims)-1))
+                if f.shape != (self.dims[site], self.dims[site]):
+                    raise ValueError("Factor on site " + str(site) + " must have shape " +
+                                     str((self.dims[site], self.dims[site])))
+                checked[site] = f
+            self.terms.append((complex(c), checked))
+
+    @property
+    def shape(self):
+        d = int(np.prod(self.dims))
+        return (d, d)
+
+    def _check(self, other):
+        if self.dims != other.dims:
+            raise ValueError("Operators act on spaces with different dimensions.")
+
+    def __add__(self, other):
+        if isinstance(other, numbers.Number):
+            if other == 0:
+                return self
+            other = LocalOperator(self.dims, [(other, {})])
+        if not isinstance(other, LocalOperator):
+            return NotImplemented
+        self._check(other)
+        return LocalOperator(self.dims, self.terms + other.terms)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return LocalOperator(self.dims, [(-c, f) for c, f in self.terms])
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def __mul__(self, other):
+        if isinstance(other, numbers.Number):
+            return LocalOperator(self.dims, [(c*other, f) for c, f in self.terms])
+        if isinstance(other, LocalOperator):
+            self._check(other)
+            terms = []
+            for c1, f1 in self.terms:
+                for c2, f2 in other.terms:
+                    factors = dict(f2)
+                    for site, f in f1.items():
+                        factors[site] = f.dot(factors[site]) if site in factors else f
+                    terms.append((c1*c2, factors))
+            return LocalOperator(self.dims, terms)
+        if isinstance(other, (qtp.Qobj, np.ndarray)):
+            return self.apply(other)
+        return NotImplemented
+
+    def __rmul__(self, other):
+        if isinstance(other, numbers.Number):
+            return self*other
+        return NotImplemented
+
+    def __truediv__(self, other):
+        return self*(1./other)
+
+    __div__ = __truediv__
+
+    def dag(self):
+        """Return the Hermitian conjugate, still in factored form.
+        """
+        return LocalOperator(self.dims, [(np.conjugate(c), dict((s, f.conj().T) for s, f in fs.items()))
+                                         for c, fs in self.terms])
+
+    def apply(self, state):
+        """Return O|psi> for a ket or O*rho for a density matrix without building O.
+        state is a qutip ket/operator or a numpy array of matching dimension.
+        Only the axes of the sites a term acts on are contracted.
+        """
+        is_qobj = isinstance(state, qtp.Qobj)
+        data = state.full() if is_qobj else np.asarray(state)
+        d = self.shape[0]
+        if data.shape[0] != d:
+            raise ValueError("State dimension " + str(data.shape[0]) + " does not match operator dimension " + str(d))
+        columns = data.reshape(d, -1)
+        psi = columns.reshape(self.dims + [columns.shape[1]])
+        out = np.zeros(psi.shape, dtype=complex)
+        for c, factors in self.terms:
+            tmp = psi
+            for site, f in factors.items():
+                tmp = np.moveaxis(np.tensordot(f, tmp, axes=([1], [site])), 0, site)
+            out += c*tmp
+        out = out.reshape(data.shape)
+        if is_qobj:
+            return qtp.Qobj(out, dims=state.dims)
+        return out
+
+    def expect(self, state):
+        """Return the expectation value <psi|O|psi> or Tr(O*rho).
+        """
+        data = state.full() if isinstance(state, qtp.Qobj) else np.asarray(state)
+        out = self.apply(data)
+        if data.ndim == 1 or data.shape[1] == 1:
+            return np.vdot(data.ravel(), out.ravel())
+        return np.trace(out)
+
+    def to_sparse(self):
+        """Materialize the operator as a scipy CSR matrix.
+        """
+        d = self.shape[0]
+        total = sp.csr_matrix((d, d), dtype=complex)
+        for c, factors in self.terms:
+            m = sp.identity(1, dtype=complex, format='csr')
+            for site, dim in enumerate(self.dims):
+                f = factors.get(site)
+                m = sp.kron(m, sp.identity(dim, dtype=complex, format='csr') if f is None else sp.csr_matrix(f),
+                            format='csr')
+            total = total + c*m
+        total.eliminate_zeros()
+        return total
+
+    def to_qobj(self):
+        """Materialize the operator as a qutip operator with tensor product dims.
+        """
+        return qtp.Qobj(self.to_sparse(), dims=[self.dims, self.dims])
+
+
+def materialize(op):
+    """Return op as a qutip object, building the matrix if op is a LocalOperator.
+    """
+    if isinstance(op, LocalOperator):
+        return op.to_qobj()
+    return op
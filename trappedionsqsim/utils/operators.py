@@ -3,6 +3,10 @@ from __future__ import division, absolute_import, print_function, unicode_litera
 import qutip as qtp
 import numpy as np
 from scipy import *
+from scipy import linalg
+from .cache import LRUCache, qobj_nbytes
+from .localops import LocalOperator
+from . import instrument
 
 #A library for automatical generation of quantum operators 
 #Created by Omid Khosravani
@@ -10,6 +14,35 @@ from scipy import *
 #2017-2019 
  
 
+_lamb_dicke_cache = LRUCache(max_entries=256)
+
+
+def lamb_dicke_sidebands(eta, dim_of_Fock_space, order=None):
+    """Return the sideband components of exp(1j*eta*(a + a^dagger)) on a Fock space truncated to 
+    dim_of_Fock_space levels, as a dictionary s -> matrix keeping only the elements <n+s|.|n>, i.e. the 
+    part changing the phonon number by s. order=None uses the exact matrix exponential, an integer 
+    order the Taylor expansion up to (1j*eta*(a + a^dagger))^order/order!.
+    Results are cached per (eta, dim_of_Fock_space, order) and must not be modified.
+    """
+    def build():
+        x = 1j*eta*(qtp.destroy(dim_of_Fock_space) + qtp.create(dim_of_Fock_space)).full()
+        if order is None:
+            M = linalg.expm(x)
+        else:
+            M = np.eye(dim_of_Fock_space, dtype=complex)
+            term = np.eye(dim_of_Fock_space, dtype=complex)
+            for k in range(1, order+1):
+                term = term.dot(x)/k
+                M = M + term
+        sidebands = {}
+        for shift in range(-dim_of_Fock_space+1, dim_of_Fock_space):
+            diagonal = np.diag(M, -shift)
+            if np.any(diagonal != 0):
+                sidebands[shift] = np.diag(diagonal, -shift)
+        return sidebands
+    return _lamb_dicke_cache.get_or_build((float(eta), dim_of_Fock_space, order), build)
+
+
 class Operators(object):
     """
     Create necessary operators for constructing a Hamiltonian of an ion chain with arbitrary Hilbert space dimensions 
@@ -17,11 +50,20 @@ class Operators(object):
     dim_of_electronic_states_space,
     number_of_motional_modes,
     dim_of_each_Fock_space
+
+    Single-site operators are memoized per instance, keyed on (kind, index, dims).
+    cache_size = maximum number of cached operators (None for unbounded)
+    cache_bytes = maximum total size of cached operators in bytes (None for unbounded)
+    prewarm = build all single-site operators at construction
+    Cached operators are shared between calls and must not be modified in place.
     """
     def __init__(self, number_of_ions = 1,
                 dim_of_electronic_states_space = 2,
                 number_of_motional_modes = 0,
-                dim_of_each_Fock_space = 0):
+                dim_of_each_Fock_space = 0,
+                cache_size = 1024,
+                cache_bytes = 256*2**20,
+                prewarm = False):
 
         self.N_e = number_of_ions
         self.D_F = dim_of_each_Fock_space
@@ -34,6 +76,45 @@ class Operators(object):
         if self.N_F>0:
             self._error(self.D_F, 2, float("inf"), "Dimension of Fock space of the motional state of each ion")
 
+        self._cache = LRUCache(cache_size, cache_bytes, qobj_nbytes)
+        if prewarm:
+            self.prewarm()
+
+    def _cached(self, kind, index, builder):
+        """Return the operator of the given kind acting on site index, building it on a cache miss.
+        """
+        key = (kind, index, (self.N_e, self.D_e, self.N_F, self.D_F))
+        if instrument.enabled():
+            instrument.count('operators.cache_hits' if key in self._cache else 'operators.builds')
+            timed_builder = builder
+            def builder():
+                with instrument.timer('operators.build'):
+                    return timed_builder()
+        return self._cache.get_or_build(key, builder)
+
+    def cache_info(self):
+        """Return hit/miss/eviction statistics and the memory footprint of the operator cache.
+        """
+        return self._cache.info()
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def prewarm(self):
+        """Build and cache every single-site operator of the ion chain.
+        """
+        self.id()
+        for ion_num in range(1, self.N_e+1):
+            self.sm(ion_num)
+            self.sp(ion_num)
+            if self.D_e == 2:
+                self.sx(ion_num)
+                self.sy(ion_num)
+                self.sz(ion_num)
+        for mode_num in range(1, self.N_F+1):
+            self.a(mode_num)
+            self.ad(mode_num)
+
     def a(self, mode_num):
         """
         params
@@ -45,9 +126,9 @@ class Operators(object):
             raise ValueError("Fock space is not defined")
         self._error(mode_num, 1, self.N_F, "Mode number")
 
-        return qtp.tensor( [qtp.qeye(self.D_e)
+        return self._cached('a', mode_num, lambda: qtp.tensor( [qtp.qeye(self.D_e)
             for i in range(self.N_e)] + 
-            [ qtp.destroy(self.D_F) if j == mode_num else qtp.qeye(self.D_F) for j in range(1, self.N_F+1) ] )
+            [ qtp.destroy(self.D_F) if j == mode_num else qtp.qeye(self.D_F) for j in range(1, self.N_F+1) ] ))
 
     def ad(self, mode_num):
         """
@@ -56,7 +137,7 @@ class Operators(object):
 
         return an creation operator on the mode_num-th Fock space.
         """
-        return self.a(mode_num).dag()
+        return self._cached('ad', mode_num, lambda: self.a(mode_num).dag())
 
     def _error(self, i,min_lim, max_lim, st):
 
@@ -72,9 +153,9 @@ class Operators(object):
         self._error(ion_num, 1, self.N_e, "Ion number")
 
         
-        return qtp.tensor( [qtp.destroy(self.D_e) if j == ion_num else qtp.qeye(self.D_e) 
+        return self._cached('sm', ion_num, lambda: qtp.tensor( [qtp.destroy(self.D_e) if j == ion_num else qtp.qeye(self.D_e) 
                         for j in range(1, self.N_e+1)]
-                        + [ qtp.qeye(self.D_F) for j in range(self.N_F) ] )
+                        + [ qtp.qeye(self.D_F) for j in range(self.N_F) ] ))
 
     
     def sp(self, ion_num):
@@ -84,13 +165,51 @@ class Operators(object):
         self._error(ion_num, 1, self.N_e, "Ion number")
 
         
-        return qtp.tensor( [qtp.create(self.D_e) if j == ion_num else qtp.qeye(self.D_e) 
+        return self._cached('sp', ion_num, lambda: qtp.tensor( [qtp.create(self.D_e) if j == ion_num else qtp.qeye(self.D_e) 
                         for j in range(1, self.N_e+1)]
-                        + [ qtp.qeye(self.D_F) for j in range(self.N_F) ] )
+                        + [ qtp.qeye(self.D_F) for j in range(self.N_F) ] ))
 
 
   
 
+    def fock_populations(self, state, mode_num):
+        """Return the populations of the Fock levels 0, 1, ... D_F-1 of the mode_num-th motional mode
+        for a ket or a density matrix, mode_num = 1, 2, ... number_of_motional_modes.
+        """
+        if self.N_F == 0:
+            raise ValueError("Fock space is not defined")
+        self._error(mode_num, 1, self.N_F, "Mode number")
+        data = state.full() if isinstance(state, qtp.Qobj) else np.asarray(state)
+        if data.ndim == 2 and data.shape[0] == data.shape[1] and data.shape[0] > 1:
+            probabilities = np.real(np.diag(data))
+        else:
+            probabilities = np.abs(data.ravel())**2
+        axis = self.N_e + mode_num - 1
+        probabilities = probabilities.reshape(self.site_dims())
+        return probabilities.sum(axis=tuple(i for i in range(probabilities.ndim) if i != axis))
+
+    def fock_leakage(self, state, top=1):
+        """Return, for each motional mode, the population in its top highest Fock levels.
+        """
+        return [self.fock_populations(state, m)[-top:].sum() for m in range(1, self.N_F+1)]
+
+    def embed_fock(self, state, dim_of_each_Fock_space):
+        """Return a ket or density matrix of this space embedded in the space with 
+        dim_of_each_Fock_space >= D_F levels per motional mode (the new levels are empty).
+        """
+        if dim_of_each_Fock_space < self.D_F:
+            raise ValueError("The new Fock space dimension must be at least " + str(self.D_F))
+        data = state.full()
+        is_oper = state.isoper
+        pad = [(0, 0)]*self.N_e + [(0, dim_of_each_Fock_space - self.D_F)]*self.N_F
+        new_dims = [self.D_e]*self.N_e + [dim_of_each_Fock_space]*self.N_F
+        if is_oper:
+            data = np.pad(data.reshape(self.site_dims()*2), pad*2)
+            d = int(np.prod(new_dims))
+            return qtp.Qobj(data.reshape(d, d), dims=[new_dims, new_dims])
+        data = np.pad(data.reshape(self.site_dims()), pad)
+        return qtp.Qobj(data.reshape(-1, 1), dims=[new_dims, [1]*len(new_dims)])
+
     def dm_pure(self, e_state_list, motional_state_list=[]):
         """Return a density matrix of a pure quantum state, with first self.N enries the electronic states of ions,
         and the second self.N entries the motional states of ions.
@@ -128,21 +247,53 @@ class Operators(object):
         """
         return qtp.tensor( self.ket(e_state_list, motional_state_list),  self.ket(e_state_list, motional_state_list).dag() )
     
-    def coupling(self, state1, state2): #Not tested
+    @instrument.timed('operators.coupling')
+    def coupling(self, state1, state2):
         """Projection operator |state1><state2|
          where state1&2 each are the states number list 
         go from 0 to self.D_e-1
         and 
         go from 0 to self.D_F-1
+        An electronic state number of -1 (in the same position of state1 and state2) 
+        leaves that ion untouched (identity), and state lists without a motional part
+        act as identity on all motional modes, e.g. coupling([[-1, 0]], [[-1, 2]]) = I (x) |0><2| (x) I_motion
         """
         if len(state1)==2 and len(state2) ==2:
             e_state_list1, motional_state_list1 = state1[0], state1[1]
             e_state_list2, motional_state_list2 = state2[0], state2[1]
         elif len(state1)==1 and len(state2) ==1:
-            e_state_list1, motional_state_list1 = state1[0], []
-            e_state_list2, motional_state_list2 = state2[0], []
+            e_state_list1, motional_state_list1 = state1[0], None
+            e_state_list2, motional_state_list2 = state2[0], None
+        else:
+            raise ValueError("States must be given as [e_state_list] or [e_state_list, motional_state_list]")
+
+        for e_state_list in (e_state_list1, e_state_list2):
+            if len(e_state_list) != self.N_e:
+                raise ValueError("Length of electronic_state_list must be equal to " + str(self.N_e) )
+            for i in e_state_list:
+                self._error(i, -1, self.D_e-1, "Electronic state number")
+
+        factors = []
+        for i, j in zip(e_state_list1, e_state_list2):
+            if i == -1 and j == -1:
+                factors.append(qtp.qeye(self.D_e))
+            elif i == -1 or j == -1:
+                raise ValueError("Identity (-1) must be set on the same ion in both states")
+            else:
+                factors.append(qtp.basis(self.D_e, i) * qtp.basis(self.D_e, j).dag())
 
-        return qtp.tensor( self.ket(e_state_list1, motional_state_list1),  self.ket(e_state_list2, motional_state_list2).dag() )
+        if motional_state_list1 is None:
+            factors += [qtp.qeye(self.D_F) for j in range(self.N_F)]
+        else:
+            for motional_state_list in (motional_state_list1, motional_state_list2):
+                if len(motional_state_list) != self.N_F:
+                    raise ValueError("Length of motional_state_list must be equal to " + str(self.N_F))
+                for j in motional_state_list:
+                    self._error(j, 0, self.D_F-1, "Motional state number")
+            factors += [qtp.basis(self.D_F, i) * qtp.basis(self.D_F, j).dag()
+                        for i, j in zip(motional_state_list1, motional_state_list2)]
+
+        return qtp.tensor(factors)
 
 
     def sx(self, ion_num):
@@ -150,32 +301,81 @@ class Operators(object):
         i-th ion, where i = 1, 2, ... self.N
         """
         self._error(ion_num, 1, self.N_e, "Ion number")
-        return qtp.tensor( [qtp.sigmax() if j == ion_num else qtp.qeye(2) for j in range(1, self.N_e+1) ] + 
-                        [ qtp.qeye(self.D_F) for j in range(1, self.N_F+1)] )
+        return self._cached('sx', ion_num, lambda: qtp.tensor( [qtp.sigmax() if j == ion_num else qtp.qeye(2) for j in range(1, self.N_e+1) ] + 
+                        [ qtp.qeye(self.D_F) for j in range(1, self.N_F+1)] ))
 
     def sy(self, ion_num):
         """Return sigmay() operator acting on the electronic state of 
         i-th ion, where i = 1, 2, ... self.N
         """
         self._error(ion_num, 1, self.N_e, "Ion number")
-        return qtp.tensor( [qtp.sigmay() if j == ion_num else qtp.qeye(2) for j in range(1, self.N_e+1) ] + 
-                        [ qtp.qeye(self.D_F) for j in range(1, self.N_F+1)] )
+        return self._cached('sy', ion_num, lambda: qtp.tensor( [qtp.sigmay() if j == ion_num else qtp.qeye(2) for j in range(1, self.N_e+1) ] + 
+                        [ qtp.qeye(self.D_F) for j in range(1, self.N_F+1)] ))
 
     def sz(self, ion_num):
         """Return sigmaz() operator acting on the electronic state of 
         i-th ion, where i = 1, 2, ... self.N
         """
         self._error(ion_num, 1, self.N_e, "Ion number")
-        return qtp.tensor( [qtp.sigmaz() if j == ion_num else qtp.qeye(2) for j in range(1, self.N_e+1) ] + 
-                        [ qtp.qeye(self.D_F) for j in range(1, self.N_F+1)] )
+        return self._cached('sz', ion_num, lambda: qtp.tensor( [qtp.sigmaz() if j == ion_num else qtp.qeye(2) for j in range(1, self.N_e+1) ] + 
+                        [ qtp.qeye(self.D_F) for j in range(1, self.N_F+1)] ))
 
 
     def id(self, ion_num=1):
         """Return identity operator acting on the entire Hilbert space 
         of the problem.
         """
-        return qtp.tensor( [qtp.qeye(self.D_e) for j in range(self.N_e) ] + 
-                   [qtp.qeye(self.D_F) for j in range(self.N_F)] )
+        return self._cached('id', None, lambda: qtp.tensor( [qtp.qeye(self.D_e) for j in range(self.N_e) ] + 
+                   [qtp.qeye(self.D_F) for j in range(self.N_F)] ))
+
+    @instrument.timed('operators.lamb_dicke')
+    def lamb_dicke(self, mode_num, eta, order=None, max_sideband=None):
+        """Return the spin-motion coupling exp(1j*eta*(a + a^dagger)) of the mode_num-th motional mode split 
+        into sidebands, as a dictionary s -> operator on the full Hilbert space changing the phonon number 
+        of that mode by s (see lamb_dicke_sidebands). order=None is exact, an integer truncates the 
+        Lamb-Dicke expansion; sidebands with |s| > max_sideband are dropped.
+        """
+        if self.N_F == 0:
+            raise ValueError("Fock space is not defined")
+        self._error(mode_num, 1, self.N_F, "Mode number")
+        sidebands = lamb_dicke_sidebands(eta, self.D_F, order)
+        ops = {}
+        for shift in sidebands:
+            if max_sideband is not None and abs(shift) > max_sideband:
+                continue
+            ops[shift] = self._cached(('lamb_dicke', float(eta), order, shift), mode_num, 
+                lambda shift=shift: qtp.tensor( [qtp.qeye(self.D_e) for i in range(self.N_e)] + 
+                    [ qtp.Qobj(sidebands[shift]) if j == mode_num else qtp.qeye(self.D_F) for j in range(1, self.N_F+1) ] ))
+        return ops
+
+    def site_dims(self):
+        """Return the list of dimensions of each tensor factor: ions first, then motional modes.
+        """
+        return [self.D_e]*self.N_e + [self.D_F]*self.N_F
+
+    def local(self, kind, index=1):
+        """Return a lazy LocalOperator storing only the single-site factor of the operator kind,
+        kind = 'sx', 'sy', 'sz', 'sm', 'sp' acting on ion index = 1, 2, ... number_of_ions,
+        kind = 'a', 'ad' acting on mode index = 1, 2, ... number_of_motional_modes,
+        kind = 'id' for the identity.
+        Products and sums of local operators stay factored until materialized with to_qobj().
+        """
+        if kind == 'id':
+            return LocalOperator(self.site_dims(), [(1., {})])
+        if kind in ('sx', 'sy', 'sz', 'sm', 'sp'):
+            self._error(index, 1, self.N_e, "Ion number")
+            if kind in ('sx', 'sy', 'sz') and self.D_e != 2:
+                raise ValueError("Pauli operators require dim_of_electronic_states_space = 2")
+            factor = {'sx': lambda: qtp.sigmax(), 'sy': lambda: qtp.sigmay(), 'sz': lambda: qtp.sigmaz(),
+                      'sm': lambda: qtp.destroy(self.D_e), 'sp': lambda: qtp.create(self.D_e)}[kind]()
+            return LocalOperator(self.site_dims(), [(1., {index-1: factor})])
+        if kind in ('a', 'ad'):
+            if self.N_F == 0:
+                raise ValueError("Fock space is not defined")
+            self._error(index, 1, self.N_F, "Mode number")
+            factor = qtp.destroy(self.D_F) if kind == 'a' else qtp.create(self.D_F)
+            return LocalOperator(self.site_dims(), [(1., {self.N_e+index-1: factor})])
+        raise ValueError("Unknown operator kind " + str(kind))
 
 
 class States(Operators):
@@ -0,0 +1,173 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import copy
+import functools
+import hashlib
+import pickle
+import types
+import qutip as qtp
+import numpy as np
+import scipy.sparse as sp
+from .cache import LRUCache
+from .localops import materialize
+from .coefficients import PhaseTable
+
+#Content-addressed cache of the propagators of pulses and gate blocks
+#2017-2019
+
+_FUNCTIONS = (types.FunctionType, types.MethodType, types.BuiltinFunctionType, functools.partial)
+
+
+def _hash_operator(h, op):
+    data = sp.csr_matrix(op.data if isinstance(op, qtp.Qobj) else op)
+    data.sort_indices()
+    h.update(repr((data.shape, op.dims if isinstance(op, qtp.Qobj) else None)).encode())
+    h.update(data.data.tobytes())
+    h.update(data.indices.tobytes())
+    h.update(data.indptr.tobytes())
+
+
+def _hash_coefficient(h, f):
+    if isinstance(f, np.ndarray):
+        h.update(b'array')
+        h.update(np.ascontiguousarray(f).tobytes())
+    elif isinstance(f, str):
+        h.update(b'str' + f.replace(' ', '').encode())
+    elif isinstance(f, (int, float, complex, np.number)):
+        h.update(b'number' + repr(complex(f)).encode())
+    elif isinstance(f, _FUNCTIONS):
+        #pickle refers to functions by name, so a hash would not change with their code or globals
+        raise ValueError("Coefficient " + repr(f) + " is a function and cannot be hashed; use an array or a string.")
+    else:
+        #splines and other coefficient objects are hashed by their pickled content
+        try:
+            h.update(b'object' + pickle.dumps(f))
+        except Exception:
+            raise ValueError("Coefficient " + repr(f) + " cannot be hashed; use an array or a string.")
+
+
+def hamiltonian_hash(Hamiltonian_list, t_arr):
+    """Return a hex digest identifying the evolution under Hamiltonian_list, a list [H0, [H1, f1], ...]
+    or frequency-tagged terms [[H1, w1, phi1], ...], over the time grid t_arr: the operator matrices
+    and dimensions, the coefficients and the time grid all enter the hash.
+    """
+    h = hashlib.sha256()
+    for H in Hamiltonian_list:
+        if isinstance(H, list):
+            _hash_operator(h, materialize(H[0]))
+            for f in H[1:]:
+                _hash_coefficient(h, f)
+        else:
+            _hash_operator(h, materialize(H))
+        h.update(b';')
+    h.update(np.asarray(t_arr, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+def _cacheable(Hamiltonian_list):
+    return not any(isinstance(f, _FUNCTIONS) for H in Hamiltonian_list if isinstance(H, list) for f in H[1:])
+
+
+def _options_key(options):
+    #solver settings that change the propagator, e.g. tolerances and method
+    settings = sorted((k, v) for k, v in vars(options).items()
+                      if isinstance(v, (bool, int, float, str)) and not k.startswith('store_'))
+    return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+
+def _nbytes(U):
+    if sp.issparse(U):
+        return U.data.nbytes + U.indices.nbytes + U.indptr.nbytes
+    return U.nbytes
+
+
+def _dot(A, B):
+    if sp.issparse(A) or not sp.issparse(B):
+        return A.dot(B)
+    return np.asarray(B.T.dot(A.T)).T
+
+
+class PropagatorCache(object):
+    """
+    Propagators U(t_arr[-1], t_arr[0]) of pulses and blocks, stored under the hash of their Hamiltonian and
+    time grid (hamiltonian_hash) and of the solver options with LRU eviction, so that repeated blocks are 
+    integrated once. Blocks with function coefficients are integrated every time, since their hash would 
+    not follow changes of the functions.
+    Propagators with a fraction of non-zero elements above dense_threshold are stored as dense arrays,
+    the others as sparse matrices.
+    params
+    max_bytes = memory budget of the stored propagators (None for unbounded)
+    max_entries = maximum number of stored propagators (None for unbounded)
+    dense_threshold = density above which a propagator is stored dense
+    chop = magnitude below which elements of a propagator are dropped before storing it sparse
+    """
+    def __init__(self, max_bytes=512*2**20, max_entries=None, dense_threshold=0.1, chop=1e-14):
+        self._cache = LRUCache(max_entries, max_bytes, _nbytes)
+        self.dense_threshold = dense_threshold
+        self.chop = chop
+
+    def __len__(self):
+        return len(self._cache)
+
+    def info(self):
+        return self._cache.info()
+
+    def clear(self):
+        self._cache.clear()
+
+    def propagator(self, Hamiltonian_list, t_arr, options=None):
+        """
+        params
+        Hamiltonian_list is a list [H0, [H1, f1], ...] with coefficients sampled on t_arr,
+        or a list of frequency-tagged terms [[H1, w1, phi1], ...]
+        t_arr is the time grid of the block
+        options is an optional qutip Options instance
+        return the propagator of the block, as a numpy array or a scipy sparse matrix; it is shared and
+        must not be modified
+        """
+        options = copy.copy(options) if options is not None else qtp.Options(atol=1e-10, rtol=1e-8)
+        if not _cacheable(Hamiltonian_list):
+            return self._build(Hamiltonian_list, t_arr, options)
+        key = hamiltonian_hash(Hamiltonian_list, t_arr) + _options_key(options)
+        return self._cache.get_or_build(key, lambda: self._build(Hamiltonian_list, t_arr, options))
+
+    def _build(self, Hamiltonian_list, t_arr, options):
+        t_arr = np.asarray(t_arr, dtype=float)
+        if len(t_arr) < 2:
+            raise ValueError("Time grid must have length at least 2.")
+        if all(isinstance(H, list) and len(H) == 3 and not isinstance(H[1], (np.ndarray, str))
+               for H in Hamiltonian_list):
+            Hamiltonian_list = PhaseTable(t_arr).hamiltonian(Hamiltonian_list)
+        Hamiltonian_list = [[materialize(H[0])] + list(H[1:]) if isinstance(H, list) else materialize(H)
+                            for H in Hamiltonian_list]
+        first = Hamiltonian_list[0] if isinstance(Hamiltonian_list[0], qtp.Qobj) else Hamiltonian_list[0][0]
+        options.store_states, options.store_final_state = False, True
+        U = qtp.sesolve(Hamiltonian_list, qtp.qeye(first.dims[0]), t_arr, [], options=options).final_state.full()
+        U[np.abs(U) < self.chop] = 0
+        if np.count_nonzero(U) > self.dense_threshold*U.size:
+            return U
+        return sp.csr_matrix(U)
+
+    def sequence(self, blocks, options=None):
+        """
+        params
+        blocks is a list of (Hamiltonian_list, t_arr) applied in order
+        return the propagator of the whole sequence, the product of the cached block propagators
+        """
+        total = None
+        for Hamiltonian_list, t_arr in blocks:
+            U = self.propagator(Hamiltonian_list, t_arr, options)
+            total = U if total is None else _dot(U, total)
+        return total
+
+    def apply(self, blocks, state, options=None):
+        """Return the qutip state (ket or density matrix) after the blocks, applying each cached propagator
+        to the state instead of composing them.
+        """
+        data = state.full()
+        for Hamiltonian_list, t_arr in blocks:
+            U = self.propagator(Hamiltonian_list, t_arr, options)
+            data = U.dot(data)
+            if not state.isket:
+                data = U.conj().dot(data.T).T #U rho U^dagger
+        return qtp.Qobj(np.asarray(data), dims=state.dims)
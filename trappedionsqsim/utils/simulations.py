@@ -2,9 +2,23 @@ from __future__ import division, absolute_import, print_function, unicode_litera
 
 import qutip as qtp
 import numpy as np
+import scipy.sparse as sp
 from scipy import *
 import types
+import copy
+import hashlib
+import os
 from .operators import Operators 
+from .localops import materialize
+from . import instrument
+from .storage import save_checkpoint, load_checkpoint, StateHistory, StateSequence
+from .hamiltonian import auto_time_grid, resample_coefficients, detect_period
+from .krylov import propagate_constant
+from .tomography import process_tomography
+from .propagators import PropagatorCache, _cacheable
+from .floquet import period_propagator, FloquetPropagator
+from .blocks import reachable_indices, restrict, restrict_list, embed
+from .diskcache import result_key
 #A library for simulation of arbitrarily long ion chains
 #Created by Omid Khosravani, okhosravani@gatech.edu
 #Duke University and Georgia Institute of Technology 
@@ -18,9 +32,17 @@ class Simulation(Operators):
                 number_of_motional_modes = 0,
                 dim_of_each_Fock_space = 0, 
                 LD_param = .0,
-                LD_order = .0):
+                LD_order = .0,
+                history_dtype = complex,
+                history_decimate = 1):
+        '''
+        history_dtype and history_decimate set the storage of states_list (see storage.StateHistory): 
+        np.complex64 halves its memory and history_decimate = k keeps only every k-th recorded state.
+        '''
         self.LD_param = LD_param
         self.LD_order = LD_order
+        self.history_dtype = history_dtype
+        self.history_decimate = history_decimate
         super(Simulation, self).__init__(number_of_ions,
                 dim_of_electronic_states_space,
                 number_of_motional_modes,
@@ -36,6 +58,8 @@ class Simulation(Operators):
                 self.D_F)
         self.Hamiltonian_list = []
         self.time_evolve_list = []
+        self.floquet = None
+        self.propagators = PropagatorCache()
 
         self.reset()
     """
@@ -53,22 +77,50 @@ class Simulation(Operators):
         self.time_evolve_list += [t_arr]
     """
 
+    @property
+    def states_list(self):
+        '''Recorded states as a read-only live sequence of qutip objects (storage.StateSequence), each built 
+        from self.history when accessed; use self.history.states for a view of the array without conversion.
+        '''
+        return StateSequence(self.history)
+
+    @property
+    def time_arr(self):
+        '''Times of the recorded states (a read-only view of self.history.times).
+        '''
+        return self.history.times
+
     def set_curr_state(self, psi): #tested
         self.curr_state = psi
     def get_curr_state(self): #tested
         return self.curr_state
 
-    def evolve_spline(self, Hamiltonian_list, t_int, N_steps=None, save_to_states_list=True, c_ops = [], observable_list=[]): #tested
+    def evolve_spline(self, Hamiltonian_list, t_int, N_steps=None, save_to_states_list=True, c_ops = [], observable_list=[], stream=None, accuracy=1e-3, reduce_blocks=False,
+                      trajectories=None): #tested
         '''
         params
         Hamiltonian_list is a list of  [ [Hamiltonian1, coef_function1], [Hamiltonian2, coef_function2], ...] some of which is the total Hamiltonian applied in t_arr
         t_int is the time-interval. If it hsa length 2 it specifies the first and last time [t1,t2]
         otherwise it must be an array will all the time stamps
         N_steps is the number of time steps to divide the time_interval corresponding to this Hamiltonian 
+        N_steps = 'auto' picks the coarsest time grid and solver step resolving the fastest frequency of 
+        Hamiltonian_list to the given accuracy (see hamiltonian.auto_time_grid); array coefficients are 
+        then assumed sampled uniformly on [t1, t2] and are resampled on the new grid, returned as output.times
         turn each function into a spline, simulate time evolution and return output, a qutip object 
         verbose will print out the average value of time_step_isValid 
+        stream is an optional storage.ObservableStream: observables are then computed on the fly and written
+        to disk at each time step instead of keeping the states; only the final state is kept in memory 
+        and nothing is added to states_list. With c_ops the density matrix is evolved (mesolve).
+        reduce_blocks = True evolves only the blocks of basis states that Hamiltonian_list and c_ops connect to 
+        the support of curr_state (see blocks.reachable_indices) and embeds the states back in the full space;
+        the evolved indices are in output.block_indices. Observables must then be operators.
+        trajectories is an optional trajectories.TrajectoryEngine running the c_ops trajectories with 
+        reproducible seeds, in parallel and with early stopping; the output then holds the mean 
+        expectation values, their standard errors and the number of trajectories run (ntraj), curr_state becomes the trajectory-averaged density 
+        matrix and nothing is added to states_list.
 
         '''
+        options = None
         if not (isinstance(t_int, list) or isinstance(t_int, np.ndarray)) or len(t_int) <2:
             raise ValueError("Time interval must be a list or array of length at least 2.")
         elif len(t_int) <2:
@@ -77,11 +129,17 @@ class Simulation(Operators):
         elif len(t_int) == 2:
             if N_steps is None:
                 raise ValueError("Number of time steps must be specified.")
+            elif isinstance(N_steps, str) and N_steps == 'auto':
+                t_arr, options = auto_time_grid(self._prepare(Hamiltonian_list, [], [])[0], 
+                                                t_int[0], t_int[1], accuracy)
+                Hamiltonian_list = resample_coefficients(Hamiltonian_list, t_int[0], t_int[1], t_arr)
             elif isinstance(N_steps, int):
                 if N_steps <2:
-                    print("N_steps must be at list 2.")
+                    raise ValueError("N_steps must be at least 2.")
                 else:
-                    t_arr = np.array(t_int[0], t_int[1], N_steps)
+                    t_arr = np.linspace(t_int[0], t_int[1], N_steps)
+            else:
+                raise ValueError("N_steps must be an integer or 'auto'.")
 
         
         elif len(t_int) <100:
@@ -98,9 +156,12 @@ class Simulation(Operators):
         if len(Hamiltonian_list)<1:
             raise ValueError("Set at least one Hamiltonian in Hamiltonian_list: [ [Hamiltonian1, coef_function1],..].")
 
-        for H in Hamiltonian_list: 
-            if not self.time_step_isValid(H[0], self.curr_state, t_arr): 
-                raise ValueError("Time steps are too large.")
+        Hamiltonian_list, c_ops, observable_list = self._prepare(Hamiltonian_list, c_ops, observable_list)
+
+        if options is None: #automatic grids are resolved by construction
+            for H in Hamiltonian_list: 
+                if not self.time_step_isValid(H[0], self.curr_state, t_arr): 
+                    raise ValueError("Time steps are too large.")
 
         if self.curr_state is None:
             raise ValueError("Initial state not set.")
@@ -108,28 +169,193 @@ class Simulation(Operators):
         #self.states_list += [self.curr_state]
 
 
-        output = qtp.mcsolve(Hamiltonian_list, self.curr_state, t_arr, c_ops, observable_list)
-        self.set_curr_state(output.states[-1])
+        if stream is not None:
+            options = copy.copy(options) if options is not None else qtp.Options()
+            options.store_states, options.store_final_state = False, True
+            output = qtp.mesolve(Hamiltonian_list, self.curr_state, t_arr, c_ops, stream, options=options)
+            stream.flush()
+            self.set_curr_state(output.final_state)
+            self.curr_t = t_arr[-1]
+            return output
 
+        if trajectories is not None and len(c_ops) > 0:
+            output = trajectories.run(Hamiltonian_list, self.curr_state, t_arr, c_ops, observable_list, options)
+            self.set_curr_state(output.final_state)
+            self.output_list += [output]
+            self.curr_t = t_arr[-1]
+            return output
 
-        if  save_to_states_list:
-            if len(self.states_list) != 0 :
-                self.states_list = self.states_list[:-1] + output.states
-            else:
-                self.states_list = output.states
+        output = self._solve(Hamiltonian_list, t_arr, c_ops, observable_list, options, store_states=save_to_states_list,
+                             reduce_blocks=reduce_blocks)
 
-            if len( self.time_arr )  != 0:
-                self.time_arr = np.concatenate( (self.time_arr[:-1], t_arr ) )
-            else: 
-                self.time_arr = t_arr
 
-            self.output_list += [output]
+        if  save_to_states_list:
+            self._record(t_arr, output)
 
         self.curr_t = t_arr[-1]
 
 
         return output
 
+    def evolve_checkpointed(self, Hamiltonian_list, t_arr, path, segment_steps=1000, c_ops=[], observable_list=[],
+                            options=None, save_to_states_list=False):
+        '''
+        params
+        Hamiltonian_list is a list of [ [Hamiltonian1, coef1], ...] as in evolve_spline, with array or string
+        coefficients (functions cannot be identified across sessions); arrays must be sampled on t_arr
+        t_arr is the array of all time stamps, t_arr[0] = curr_t
+        path is the checkpoint file
+        segment_steps is the number of time steps evolved between two checkpoints
+        options is an optional qutip Options instance
+        Split t_arr into segments and write a checkpoint (state, time, solver options, random number 
+        generator state and observables computed so far) after each segment. If path holds a checkpoint 
+        of the same run (same time grid, Hamiltonian, c_ops and observables, and curr_state either the initial 
+        state of the run or the state of the checkpoint), the evolution resumes from it instead of from 
+        t_arr[0]. The checkpoint is deleted once the last segment is done.
+        return a qutip Result with the times and expectation values of observable_list over t_arr, and the 
+        time the run resumed from (resumed_from, None for a run from t_arr[0])
+        '''
+        t_arr = np.asarray(t_arr, dtype=float)
+        n = len(t_arr)
+        if n < 2:
+            raise ValueError("Time interval must be a list or array of length at least 2.")
+        if segment_steps < 1:
+            raise ValueError("segment_steps must be greater than or equal to 1")
+        if self.curr_state is None:
+            raise ValueError("Initial state not set.")
+        if not _cacheable(Hamiltonian_list):
+            raise ValueError("Checkpointed runs need array or string coefficients, not functions.")
+        run = {'n_times': n, 'times': hashlib.sha1(t_arr.tobytes()).hexdigest(),
+               'n_observables': len(observable_list), 'dims': self.site_dims(),
+               'content': result_key(Hamiltonian_list, c_ops, observable_list)}
+        initial = result_key(self.curr_state)
+        bounds = list(range(0, n-1, segment_steps)) + [n-1]
+
+        expect = np.zeros((len(observable_list), n), dtype=complex)
+        segment = 0
+        resumed_from = None
+        if os.path.exists(path):
+            meta, arrays = load_checkpoint(path)
+            #curr_state is the initial state of the run, or the checkpointed state when the same 
+            #Simulation calls again after an interruption
+            same_state = meta.get('initial_state') == initial or (self.curr_t == meta['curr_t'] and 
+                np.array_equal(self.curr_state.full(), arrays['state']))
+            if meta['run'] != run or not same_state:
+                raise ValueError("Checkpoint " + str(path) + " was written by a different run.")
+            initial = meta['initial_state']
+            self.set_curr_state(qtp.Qobj(arrays['state'], dims=meta['state_dims']))
+            self.curr_t = meta['curr_t']
+            segment = meta['segment']
+            expect = arrays['expect']
+            np.random.set_state(('MT19937', arrays['rng_keys'], meta['rng_pos'],
+                                 meta['rng_has_gauss'], meta['rng_cached_gaussian']))
+            if options is None:
+                #some saved settings are attributes but not arguments of Options
+                options = qtp.Options()
+                for name, value in meta['options'].items():
+                    setattr(options, name, value)
+            resumed_from = self.curr_t
+        else:
+            if t_arr[0] != self.curr_t:
+                raise ValueError("First time stamp does not match the current time stamp curr_t.")
+
+        Hamiltonian_list, c_ops, observable_list = self._prepare(Hamiltonian_list, c_ops, observable_list)
+
+        for k in range(segment, len(bounds)-1):
+            i, j = bounds[k], bounds[k+1]
+            output = self._solve(_slice_coefficients(Hamiltonian_list, i, j, n), t_arr[i:j+1],
+                                 c_ops, observable_list, options, store_states=save_to_states_list)
+            for m in range(len(observable_list)):
+                expect[m, i:j+1] = output.expect[m]
+            if save_to_states_list:
+                self._record(t_arr[i:j+1], output)
+            self.curr_t = t_arr[j]
+
+            rng = np.random.get_state()
+            meta = {'run': run, 'initial_state': initial, 'curr_t': float(self.curr_t), 'segment': k+1, 'state_dims': self.curr_state.dims,
+                    'rng_pos': int(rng[2]), 'rng_has_gauss': int(rng[3]), 'rng_cached_gaussian': float(rng[4]),
+                    'options': _options_dict(options)}
+            save_checkpoint(path, meta, state=self.curr_state.full(), expect=expect, rng_keys=rng[1])
+        if os.path.exists(path):
+            os.remove(path)
+
+        result = qtp.solver.Result()
+        result.solver = 'evolve_checkpointed'
+        result.times = t_arr
+        result.expect = [expect[m] for m in range(len(observable_list))]
+        result.num_expect = len(observable_list)
+        result.final_state = self.curr_state
+        result.resumed_from = resumed_from
+        return result
+
+    def _prepare(self, Hamiltonian_list, c_ops, observable_list):
+        #Factored operators are only built into sparse matrices here, where the solver needs them
+        Hamiltonian_list = [[materialize(H[0])] + list(H[1:]) if isinstance(H, list) else materialize(H)
+                            for H in Hamiltonian_list]
+        c_ops = [materialize(c) for c in c_ops]
+        observable_list = [materialize(o) for o in observable_list]
+        return Hamiltonian_list, c_ops, observable_list
+
+    def _solve(self, Hamiltonian_list, t_arr, c_ops, observable_list, options=None, store_states=False,
+               reduce_blocks=False):
+        '''Evolve curr_state over t_arr and set curr_state to the final state.
+        With reduce_blocks the solver only sees the invariant blocks reachable from curr_state, whose indices 
+        are returned as output.block_indices (None when the whole space is evolved).
+        The hooks registered with instrument.add_hook are called with every output state.
+        '''
+        options = copy.copy(options) if options is not None else qtp.Options()
+        options.store_final_state = True
+        options.store_states = options.store_states or store_states or instrument.has_hooks()
+        state, indices = self.curr_state, None
+        if reduce_blocks:
+            indices = reachable_indices(Hamiltonian_list, state, c_ops)
+            if len(indices) == 1 and state.shape[0] > 1:
+                #qutip takes a one-dimensional state for a bra: add an unpopulated basis state, which the 
+                #invariant block does not couple to
+                indices = np.sort(np.append(indices, 1 if indices[0] == 0 else 0))
+            if len(indices) == state.shape[0]:
+                indices = None
+            else:
+                Hamiltonian_list = restrict_list(Hamiltonian_list, indices)
+                c_ops = [restrict(c, indices) for c in c_ops]
+                observable_list = [restrict(o, indices) for o in observable_list]
+                state = restrict(state, indices)
+        instrument.count('solver.calls')
+        instrument.count('solver.output_steps', len(t_arr))
+        with instrument.timer('simulation.solve'):
+            output = qtp.mcsolve(Hamiltonian_list, state, t_arr, c_ops, observable_list, options=options)
+        if indices is not None:
+            dims = self.curr_state.dims
+            output.states = _embed_all(output.states, indices, dims)
+            if output.final_state is not None:
+                output.final_state = _embed_all(output.final_state, indices, dims)
+        output.block_indices = indices
+        self.set_curr_state(output.states[-1] if len(output.states) else output.final_state)
+        if instrument.has_hooks():
+            for t, psi in zip(t_arr, output.states):
+                instrument.step(t, psi)
+        return output
+
+    @instrument.timed('simulation.record')
+    def _record(self, t_arr, output):
+        '''Append the states of a solver output and their times to self.history; the first 
+        time stamp of t_arr is the last one already stored, whose state is replaced.
+        '''
+        states = output.states
+        if len(states) and not isinstance(states[0], qtp.Qobj):
+            #one list of kets per trajectory: record the density matrix averaged over trajectories
+            states = [sum(qtp.ket2dm(traj[i]) for traj in states)/len(states) for i in range(len(t_arr))]
+        n, nbytes = len(self.history), self.history.nbytes
+        self.history.extend(t_arr, states, overlap=True)
+        if instrument.enabled():
+            instrument.count('states.stored', len(self.history) - n)
+            instrument.count('states.bytes', self.history.nbytes - nbytes)
+
+        #the states are kept in self.history only
+        output = copy.copy(output)
+        output.states = []
+        self.output_list += [output]
+
 
     def time_step_isValid(self, Hamiltonian, psi, t_arr):#t1,t2, steps_num): #tested
         '''Check to see if time step is small enough 
@@ -139,40 +365,382 @@ class Simulation(Operators):
         return 50*int(abs(qtp.expect(Hamiltonian, psi)*(t_arr[1]-t_arr[0]) /np.pi) ) < 1.
 
 
-    def apply_gate(self, gate_string,  duration=0, save_to_states_list=True): #duration = 0 tested, duration>0 is buggy
+    def apply_gate(self, gate_string,  duration=0, save_to_states_list=True, N_steps=2): #tested
         '''
         params
         set qubit gate S operator from Pauli basis {X, Y, Z, I} for 1 qubit, 
         and S operator from {XX, XY, XZ, XI, YX, YY, YZ, YI, ...} for 2 qubits,
         and so on. 
+        duration = 0 applies the gate instantaneously. duration > 0 evolves curr_state for that time under 
+        the constant Hamiltonian pi/(2*duration)*S (see evolve_constant), recording N_steps time stamps; 
+        for qubits the final state is -1j*S times the initial one.
         '''
+        if duration > 0.:
+            H = np.pi/(2*duration)*self.gate.get_pauli(gate_string)
+            return self.evolve_constant(H, [self.curr_t, self.curr_t + duration], N_steps,
+                                        save_to_states_list=save_to_states_list)
 
-        self.curr_state = self.gate.get_pauli(gate_string) * self.curr_state
+        if self.D_e == 2:
+            self.curr_state = self.gate.apply_pauli(gate_string, self.curr_state)
+        else:
+            self.curr_state = self.gate.get_pauli(gate_string) * self.curr_state
 
         if save_to_states_list:
-            
-            if len(self.states_list)>0:
-                self.states_list = self.states_list[:-1] + [self.curr_state]
-            else: 
-                self.states_list = self.curr_state
+            self.history.append(self.curr_t, self.curr_state, replace=True)
 
+    def evolve_constant(self, Hamiltonian, t_int, N_steps=2, c_ops=[], observable_list=[], save_to_states_list=True):
+        '''
+        params
+        Hamiltonian is a time-independent Hamiltonian, or None for a free evolution without Hamiltonian
+        t_int is [t1, t2], divided into N_steps time stamps, or an array of all the time stamps
+        c_ops is an optional list of collapse operators; the density matrix is then evolved
+        Evolve curr_state by applying exp(-1j*Hamiltonian*t) to it (krylov.propagate_constant) instead of 
+        integrating the Schrodinger equation, so N_steps only sets the output times, not the accuracy.
+        return a qutip Result with the times, states and expectation values of observable_list
+        '''
+        if not (isinstance(t_int, list) or isinstance(t_int, np.ndarray)) or len(t_int) <2:
+            raise ValueError("Time interval must be a list or array of length at least 2.")
+        if len(t_int) == 2:
+            if N_steps <2:
+                raise ValueError("N_steps must be at least 2.")
+            t_arr = np.linspace(t_int[0], t_int[1], N_steps)
+        else:
+            t_arr = np.asarray(t_int, dtype=float)
+        if t_arr[0] != self.curr_t:
+            raise ValueError("First time stamp does not match the current time stamp curr_t.")
+        if self.curr_state is None:
+            raise ValueError("Initial state not set.")
 
-            if duration > 0.:
-                if len(self.time_arr) > 0:
-                    self.time_arr = np.concatenate( (self.time_arr, np.array([self.time_arr[-1]+duration]) ) )
-                else:
-                    self.time_arr = np.array([self.curr_t, self.curr_t+duration]) 
+        with instrument.timer('simulation.propagate_constant'):
+            states = propagate_constant(Hamiltonian, self.curr_state, t_arr, c_ops)
+        for t, psi in zip(t_arr, states) if instrument.has_hooks() else []:
+            instrument.step(t, psi)
+        output = _result('evolve_constant', t_arr, states, [materialize(o) for o in observable_list])
+        self.set_curr_state(states[-1])
+        if save_to_states_list:
+            self._record(t_arr, output)
+        self.curr_t = t_arr[-1]
+        return output
 
+    def run_sequence(self, sequence, N_steps=2, c_ops=[], observable_list=[], save_to_states_list=True):
+        '''
+        params
+        sequence is a list of steps applied in order:
+            ('gate', gate_string) instantaneous gate (see apply_gate)
+            ('gate', gate_string, duration) timed gate
+            ('delay', duration) free evolution, or ('delay', duration, Hamiltonian) under a constant Hamiltonian
+            ('pulse', Hamiltonian, duration) evolution under a constant Hamiltonian
+            ('block', Hamiltonian_list, t_arr) cached propagator of a time-dependent block (see apply_block)
+        N_steps is the number of time stamps recorded in each timed step
+        c_ops is an optional list of collapse operators acting during the timed steps
+        Every timed step is evolved with evolve_constant, e.g. for Ramsey and spin echo sequences.
+        return a qutip Result with the times, states and expectation values of observable_list over the sequence;
+        an instantaneous gate replaces the state at its time stamp
+        '''
+        if self.curr_state is None:
+            raise ValueError("Initial state not set.")
+        times, states = [self.curr_t], [self.curr_state]
+        for step in sequence:
+            kind = step[0]
+            if kind == 'block':
+                self.apply_block(step[1], step[2], save_to_states_list)
+                times.append(self.curr_t)
+                states.append(self.curr_state)
+                continue
+            if kind == 'gate' and (len(step) < 3 or step[2] == 0):
+                self.apply_gate(step[1], save_to_states_list=save_to_states_list)
+                states[-1] = self.curr_state
+                continue
+            if kind == 'gate':
+                Hamiltonian, duration = np.pi/(2*step[2])*self.gate.get_pauli(step[1]), step[2]
+            elif kind == 'delay':
+                Hamiltonian, duration = (step[2] if len(step) > 2 else None), step[1]
+            elif kind == 'pulse':
+                Hamiltonian, duration = step[1], step[2]
+            else:
+                raise ValueError("Unknown sequence step " + str(kind))
+            if duration <= 0:
+                raise ValueError("Duration of a " + str(kind) + " must be positive.")
+            output = self.evolve_constant(Hamiltonian, [self.curr_t, self.curr_t + duration], N_steps, c_ops,
+                                          save_to_states_list=save_to_states_list)
+            times += list(output.times[1:])
+            states += output.states[1:]
+        return _result('run_sequence', np.array(times), states, [materialize(o) for o in observable_list])
+
+    def apply_block(self, Hamiltonian_list, t_arr, save_to_states_list=True, options=None):
+        '''
+        params
+        Hamiltonian_list is a list [H0, [H1, f1], ...] with coefficients sampled on t_arr, or a list of 
+        frequency-tagged terms [[H1, w1, phi1], ...]
+        t_arr is the time grid of the block, relative to its start (usually starting at 0)
+        Apply the propagator of the block to curr_state and advance curr_t by its duration. The propagator is 
+        integrated once and kept in self.propagators (a propagators.PropagatorCache), keyed on the content of 
+        the block, so repeating a block costs a single matrix product. Only the final state is recorded.
+        '''
+        if self.curr_state is None:
+            raise ValueError("Initial state not set.")
+        self.set_curr_state(self.propagators.apply([(Hamiltonian_list, t_arr)], self.curr_state, options))
+        self.curr_t = self.curr_t + t_arr[-1] - t_arr[0]
+        if save_to_states_list:
+            self.history.append(self.curr_t, self.curr_state)
 
+    def evolve_floquet(self, terms, n_periods, period=None, N_steps=1000, observable_list=[],
+                       save_to_states_list=True, options=None, method='eigen'):
+        '''
+        params
+        terms is a list of frequency-tagged terms [[H1, w1, phi1], [H2, w2, phi2], ...] of a periodic Hamiltonian
+        n_periods is the number of periods to evolve
+        period is the period of the Hamiltonian; None detects it from the frequencies (hamiltonian.detect_period)
+        N_steps is the number of time steps of the integration grid over one period
+        Integrate the one-period propagator once (floquet.period_propagator) and return the states at every 
+        period curr_t + k*period, k = 0..n_periods (see floquet.FloquetPropagator.stroboscopic), so the cost 
+        hardly depends on n_periods. The propagator is kept in self.floquet.
+        return a qutip Result with the stroboscopic times, states and expectation values of observable_list
+        and the period used (period)
+        '''
+        if self.curr_state is None:
+            raise ValueError("Initial state not set.")
+        if n_periods < 1:
+            raise ValueError("n_periods must be at least 1.")
+        if period is None:
+            period = detect_period(terms)
+            if period is None:
+                raise ValueError("No common period of the frequencies found; set period.")
+        terms = [[materialize(term[0])] + list(term[1:]) for term in terms]
+        U = period_propagator(terms, period, self.curr_t, N_steps, options)
+        self.floquet = FloquetPropagator(U, period, self.curr_t)
+        t_arr = self.curr_t + period*np.arange(n_periods + 1)
+        states = self.floquet.stroboscopic(self.curr_state, np.arange(n_periods + 1), method)
+        output = _result('evolve_floquet', t_arr, states, [materialize(o) for o in observable_list])
+        output.period = period
+        self.set_curr_state(states[-1])
+        if save_to_states_list:
+            self._record(t_arr, output)
+        self.curr_t = t_arr[-1]
+        return output
+
+    def evolve_batch(self, Hamiltonian_list, states, t_int, N_steps=None, options=None, store_states=False):
+        '''
+        params
+        Hamiltonian_list is a list of [ [Hamiltonian1, coef_function1], ...] as in evolve_spline
+        states is a list of k initial kets at curr_t
+        t_int is [t1, t2], divided into N_steps time stamps, or an array of all the time stamps
+        options is an optional qutip Options instance
+        store_states = True keeps the batch at every time stamp, otherwise only at the final time
+        Evolve all states in a single solver pass with the block-diagonal Hamiltonian I_k x H, so that the 
+        solver setup and right-hand-side evaluations are shared by the batch. curr_state and curr_t are 
+        left unchanged.
+        return a qutip Result with final_state the list of the k final kets and, with store_states, 
+        states the list over time stamps of the lists of k kets
+        '''
+        if len(states) < 1:
+            raise ValueError("Set at least one initial state.")
+        if not (isinstance(t_int, list) or isinstance(t_int, np.ndarray)) or len(t_int) <2:
+            raise ValueError("Time interval must be a list or array of length at least 2.")
+        if len(t_int) == 2:
+            if N_steps is None or N_steps <2:
+                raise ValueError("N_steps must be at least 2.")
+            t_arr = np.linspace(t_int[0], t_int[1], N_steps)
+        else:
+            t_arr = np.asarray(t_int, dtype=float)
+
+        Hamiltonian_list = self._prepare(Hamiltonian_list, [], [])[0]
+        k, dims = len(states), states[0].dims
+        identity = sp.identity(k, dtype=complex, format='csr')
+        batch_list = [qtp.Qobj(sp.kron(identity, H.data, format='csr')) if isinstance(H, qtp.Qobj) 
+                      else [qtp.Qobj(sp.kron(identity, H[0].data, format='csr'))] + list(H[1:])
+                      for H in Hamiltonian_list]
+        psi = qtp.Qobj(np.concatenate([np.asarray(state.full()) for state in states]))
+
+        options = copy.copy(options) if options is not None else qtp.Options()
+        options.store_states, options.store_final_state = store_states, True
+        options.normalize_output = False #the stacked ket has norm sqrt(k)
+        output = qtp.sesolve(batch_list, psi, t_arr, [], options=options)
+
+        split = lambda big: [qtp.Qobj(x[:, None], dims=dims) for x in big.full().reshape(k, -1)]
+        result = qtp.solver.Result()
+        result.solver = 'evolve_batch'
+        result.times = t_arr
+        result.states = [split(big) for big in output.states] if store_states else []
+        result.final_state = split(output.final_state)
+        return result
+
+    def process_tomography(self, Hamiltonian_list, t_int, logical, N_steps=None, motional_state=None, 
+                           target=None, options=None):
+        '''
+        params
+        Hamiltonian_list, t_int and N_steps as in evolve_batch
+        logical is the list of d logical kets of the electronic space of all the ions
+        motional_state is the initial ket of the motional modes (default: ground state of every mode)
+        target is an optional d x d target unitary in the logical basis
+        Evolve the d logical states with the motion in motional_state in one batch (evolve_batch) and return 
+        the process of the electronic states at the final time, the motion being traced out 
+        (see tomography.process_tomography: Kraus operators, superoperator, chi matrix and fidelities).
+        '''
+        if self.N_F > 0:
+            if motional_state is None:
+                motional_state = qtp.tensor([qtp.basis(self.D_F, 0) for m in range(self.N_F)])
+            inputs = [qtp.tensor(l, motional_state) for l in logical]
+        else:
+            inputs = list(logical)
+        output = self.evolve_batch(Hamiltonian_list, inputs, t_int, N_steps, options)
+        return process_tomography(output.final_state, logical, self.N_e, target)
+
+    def lamb_dicke(self, mode_num, eta=None, order=None, max_sideband=None):
+        '''Sideband components of exp(1j*eta*(a + a^dagger)) of the mode_num-th mode (see Operators.lamb_dicke),
+        with eta = LD_param and the expansion order LD_order by default; LD_order <= 0 selects the exact 
+        exponential.
+        '''
+        if eta is None:
+            eta = self.LD_param
+        if order is None and self.LD_order > 0:
+            order = int(self.LD_order)
+        return super(Simulation, self).lamb_dicke(mode_num, eta, order, max_sideband)
+
+    def resize_fock(self, dim_of_each_Fock_space):
+        '''Grow the truncation of every motional mode to dim_of_each_Fock_space levels, re-embedding 
+        curr_state and states_list; cached operators and gates are rebuilt for the new dimension.
+        '''
+        embed = self.embed_fock
+        if self.curr_state is not None:
+            self.curr_state = embed(self.curr_state, dim_of_each_Fock_space)
+        self.history.transform(lambda psi: embed(psi, dim_of_each_Fock_space))
+        self.D_F = dim_of_each_Fock_space
+        self.clear_cache()
+        self.gate = Gate(self.N_e,
+                self.D_e,
+                self.N_F,
+                self.D_F)
+
+    def evolve_adaptive_fock(self, build_hamiltonian, t_arr, tol=1e-6, top=1, grow=2, max_dim=None,
+                             segment_steps=100, c_ops=[], build_observables=None, save_to_states_list=True):
+        '''
+        params
+        build_hamiltonian is a function(simulation) returning the Hamiltonian_list for the current 
+        dimensions of the simulation; array coefficients must be sampled on t_arr
+        t_arr is the array of all time stamps, t_arr[0] = curr_t
+        tol is the largest population allowed in the top Fock levels of any mode
+        grow is the number of Fock levels added when tol is exceeded, up to max_dim
+        build_observables is an optional function(simulation) returning the observable list 
+        Evolve segment by segment; when the population in the top highest levels of a mode exceeds tol 
+        during a segment, the truncation is grown, the state re-embedded and the segment repeated. 
+        return a qutip Result with the times, the expectation values and the final state; 
+        the leakage history is in Result.fock_leakage and the list of truncation changes 
+        (time of the repeated segment, new dimension) in Result.fock_resizes
+        '''
+        if self.N_F == 0:
+            raise ValueError("Fock space is not defined")
+        t_arr = np.asarray(t_arr, dtype=float)
+        n = len(t_arr)
+        if t_arr[0] != self.curr_t:
+            raise ValueError("First time stamp does not match the current time stamp curr_t.")
+        if self.curr_state is None:
+            raise ValueError("Initial state not set.")
+        bounds = list(range(0, n-1, segment_steps)) + [n-1]
+
+        expect = None
+        leakage = np.zeros((n, self.N_F))
+        resizes = []
+        built_for = None
+        for k in range(len(bounds)-1):
+            i, j = bounds[k], bounds[k+1]
+            while True:
+                if built_for != self.D_F:
+                    Hamiltonian_list, c_list, observables = self._prepare(
+                        build_hamiltonian(self), c_ops if not callable(c_ops) else c_ops(self),
+                        build_observables(self) if build_observables is not None else [])
+                    built_for = self.D_F
+                start = self.curr_state
+                output = self._solve(_slice_coefficients(Hamiltonian_list, i, j, n), t_arr[i:j+1],
+                                     c_list, observables, store_states=True)
+                segment_leakage = np.array([self.fock_leakage(psi, top) for psi in output.states])
+                if segment_leakage.max() <= tol or (max_dim is not None and self.D_F >= max_dim):
+                    break
+                new_dim = self.D_F + grow if max_dim is None else min(self.D_F + grow, max_dim)
+                resizes.append((t_arr[i], new_dim))
+                self.curr_state = start
+                self.resize_fock(new_dim)
+
+            leakage[i:j+1] = segment_leakage
+            if expect is None:
+                expect = np.zeros((len(observables), n), dtype=complex)
+            for m in range(len(observables)):
+                expect[m, i:j+1] = output.expect[m]
+            if save_to_states_list:
+                self._record(t_arr[i:j+1], output)
+            self.curr_t = t_arr[j]
+
+        result = qtp.solver.Result()
+        result.solver = 'evolve_adaptive_fock'
+        result.times = t_arr
+        result.expect = [expect[m] for m in range(len(expect))]
+        result.num_expect = len(expect)
+        result.final_state = self.curr_state
+        result.fock_leakage = leakage
+        result.fock_resizes = resizes
+        return result
+
+    def fock_truncation_report(self, tol=1e-6, states=None):
+        '''Return, for each motional mode, the smallest Fock space dimension n such that the population 
+        in the levels n, n+1, ... stays below tol in every state of states (default: states_list).
+        '''
+        states = self.states_list if states is None else states
+        if len(states) == 0:
+            raise ValueError("No states to analyse.")
+        report = []
+        for m in range(1, self.N_F+1):
+            populations = np.array([self.fock_populations(psi, m) for psi in states])
+            #tail[:, n] = population in the levels n and above
+            tail = np.cumsum(populations[:, ::-1], axis=1)[:, ::-1].max(axis=0)
+            above = np.nonzero(tail > tol)[0]
+            report.append(int(above[-1]) + 1 if len(above) else 1)
+        return report
 
     def reset(self):
         #self.set_curr_state(None)
-        self.states_list = []
+        self.history = StateHistory(self.history_dtype, self.history_decimate)
         self.output_list = []
-        self.time_arr = np.array([])
         self.curr_t = 0. #Current time in simulation
 
 
+def _slice_coefficients(Hamiltonian_list, start, stop, n_times):
+    '''Restrict array coefficients sampled on a grid of n_times points to the points start...stop.
+    '''
+    sliced = []
+    for H in Hamiltonian_list:
+        if isinstance(H, list) and isinstance(H[1], np.ndarray) and len(H[1]) == n_times:
+            H = [H[0], H[1][start:stop+1]] + list(H[2:])
+        sliced.append(H)
+    return sliced
+
+
+def _embed_all(states, indices, dims):
+    #Solver states may be nested per trajectory
+    if isinstance(states, qtp.Qobj):
+        return embed(states, indices, dims)
+    return [_embed_all(s, indices, dims) for s in states]
+
+
+def _result(solver, t_arr, states, observable_list):
+    result = qtp.solver.Result()
+    result.solver = solver
+    result.times = t_arr
+    result.states = states
+    result.expect = [np.array(qtp.expect(o, states)) for o in observable_list]
+    result.num_expect = len(observable_list)
+    result.final_state = states[-1]
+    return result
+
+
+def _options_dict(options):
+    '''Return the scalar settings of a qutip Options instance.
+    '''
+    if options is None:
+        return {}
+    return dict((k, v) for k, v in vars(options).items()
+                if isinstance(v, (bool, int, float, str)) and k != 'store_final_state')
+
+
 class Gate(Operators): #tested
     def __init__(self, number_of_ions = 1,
                 dim_of_electronic_states_space = 2,
@@ -188,6 +756,15 @@ class Gate(Operators): #tested
                         dim_of_each_Fock_space)
         self.gates_dic = {'X': self.ops.sx, 'Y':self.ops.sy, 'Z':self.ops.sz, 'I':self.ops.id
                             }
+        self._pauli_actions = {}
+
+    def _check_gate_string(self, gate_string):
+        for g in gate_string:
+            if g not in self.gates_dic:
+                raise ValueError("Wrong gate specified.")
+
+        if len(gate_string) != self.ops.N_e:
+            raise ValueError("Length of gate_string must be equal to the number of qubit") 
 
     def get_pauli(self, gate_string):
         '''
@@ -196,18 +773,91 @@ class Gate(Operators): #tested
         All upper-case as in gates_dic
         return corresponding multiqubit Pauli gate
         '''
-        for g in gate_string:
-            if g not in self.gates_dic:
-                raise ValueError("Wrong gate specified.")
-
-        if len(gate_string) != self.ops.N_e:
-            raise ValueError("Length of gate_string must be equal to the number of qubit") 
+        self._check_gate_string(gate_string)
         #print( self.gates_dic[gate_string[0]] )
         pauli = self.ops.id()
         for i_num in range(len(gate_string)):
             pauli *= self.gates_dic[gate_string[i_num]](i_num+1) 
         return pauli
 
+    def pauli_action(self, gate_string):
+        '''
+        params
+        gate_string is a string of Pauli gates applied to each ion 1,2,3...
+        return (perm, phase) such that (P psi)[j] = phase[j] * psi[perm[j]] on the full Hilbert space.
+        A Pauli string is a signed permutation: X and Y flip the bit of their ion, Y and Z add a phase.
+        Results are cached per gate_string.
+        '''
+        if gate_string in self._pauli_actions:
+            return self._pauli_actions[gate_string]
+        self._check_gate_string(gate_string)
+        if self.ops.D_e != 2:
+            raise ValueError("Pauli index permutation requires dim_of_electronic_states_space = 2")
+
+        N_e = self.ops.N_e
+        dim_motion = self.ops.D_F**self.ops.N_F
+        index = np.arange(2**N_e)
+        mask = 0
+        phase = np.ones(2**N_e, dtype=complex)
+        for i_num, g in enumerate(gate_string):
+            shift = N_e - 1 - i_num #ion 1 is the most significant tensor factor
+            bit = (index >> shift) & 1
+            if g in 'XY':
+                mask |= 1 << shift
+            if g == 'Y':
+                phase *= 1j*(1 - 2*bit)
+            elif g == 'Z':
+                phase *= (1 - 2*bit)
+        perm_e = index ^ mask
+        perm = (perm_e[:, None]*dim_motion + np.arange(dim_motion)[None, :]).ravel()
+        action = (perm, np.repeat(phase[perm_e], dim_motion))
+        self._pauli_actions[gate_string] = action
+        return action
+
+    def apply_pauli(self, gate_string, state):
+        '''
+        params
+        gate_string is a string of Pauli gates applied to each ion 1,2,3...
+        state is a ket or density matrix, as a qutip object or numpy array
+        return P|psi> or P rho P^dagger, computed with an O(dim) index permutation and phase
+        instead of a matrix product.
+        '''
+        perm, phase = self.pauli_action(gate_string)
+        is_qobj = isinstance(state, qtp.Qobj)
+        data = state.full() if is_qobj else np.asarray(state)
+        if data.ndim == 2 and data.shape[0] == data.shape[1] and data.shape[0] > 1:
+            out = phase[:, None] * data[perm[:, None], perm[None, :]] * np.conj(phase)[None, :]
+        else:
+            out = (phase * data.ravel()[perm]).reshape(data.shape)
+        if is_qobj:
+            return qtp.Qobj(out, dims=state.dims)
+        return out
+
+    def apply_paulis(self, gate_strings, state):
+        '''
+        params
+        gate_strings is a list of Pauli strings
+        state is a ket, as a qutip object or numpy array
+        return an array of shape (len(gate_strings), dim) with P_k|psi> in row k
+        '''
+        psi = state.full().ravel() if isinstance(state, qtp.Qobj) else np.asarray(state).ravel()
+        actions = [self.pauli_action(g) for g in gate_strings]
+        perms = np.array([a[0] for a in actions])
+        phases = np.array([a[1] for a in actions])
+        return phases * psi[perms]
+
+    def apply_pauli_batch(self, gate_string, states):
+        '''
+        params
+        gate_string is a Pauli string
+        states is a list of kets (qutip objects) or an array of shape (number_of_states, dim)
+        return an array of shape (number_of_states, dim) with P|psi_k> in row k
+        '''
+        if isinstance(states, (list, tuple)):
+            states = np.array([s.full().ravel() if isinstance(s, qtp.Qobj) else np.ravel(s) for s in states])
+        perm, phase = self.pauli_action(gate_string)
+        return np.asarray(states)[:, perm] * phase[None, :]
+
 
 """
 class Hamiltonian(Operators): #Not tested
@@ -0,0 +1,428 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import json
+import os
+import qutip as qtp
+import numpy as np
+
+#On-disk storage of simulation results
+#2017-2019
+
+
+def fidelity_to(target):
+    """Return an observable function(t, state) giving the overlap |<target|psi>|^2
+    (or <target|rho|target> for a density matrix) with the pure state target.
+    """
+    def fidelity(t, state):
+        if state.isket:
+            return abs(target.overlap(state))**2
+        return np.real((target.dag() * state * target).tr())
+    return fidelity
+
+
+class ObservableStream(object):
+    """
+    Callback computing observables on the fly during an evolution and writing them incrementally
+    to memory-mapped .npy files in a directory, so that no trajectory is kept in memory.
+    Use as e_ops of qutip.mesolve/sesolve or as the stream argument of Simulation.evolve_spline.
+    params
+    path = directory for the result files (times.npy, observables.npy, states.npy, meta.json)
+    observables = dictionary name -> qutip operator (expectation value) or function(t, state)
+    n_times = maximum number of output times that will be written
+    save_every = also store the state at every save_every-th output time (0 stores no state)
+    """
+    def __init__(self, path, observables, n_times, save_every=0):
+        if n_times < 1:
+            raise ValueError("n_times must be greater than or equal to 1")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.names = list(observables.keys())
+        self.observables = [observables[n] for n in self.names]
+        self.n_times = n_times
+        self.save_every = save_every
+        self.count = 0
+        self.n_states = 0
+        self.dims = None
+        self.times = np.lib.format.open_memmap(os.path.join(path, 'times.npy'), mode='w+',
+                                               dtype=float, shape=(n_times,))
+        self.values = np.lib.format.open_memmap(os.path.join(path, 'observables.npy'), mode='w+',
+                                                dtype=complex, shape=(n_times, len(self.names)))
+        self.states = None
+        self._write_meta()
+
+    def __call__(self, t, state):
+        #Consecutive segments share their boundary time: the repeated point overwrites the previous row
+        row = self.count - 1 if self.count > 0 and t == self.times[self.count - 1] else self.count
+        if row >= self.n_times:
+            raise ValueError("More than n_times = " + str(self.n_times) + " output times written to the stream.")
+        self.times[row] = t
+        for k, obs in enumerate(self.observables):
+            self.values[row, k] = obs(t, state) if callable(obs) and not isinstance(obs, qtp.Qobj) \
+                else qtp.expect(obs, state)
+        if self.save_every and row % self.save_every == 0:
+            self._save_state(row // self.save_every, state)
+        self.count = row + 1
+
+    def _save_state(self, index, state):
+        data = state.full()
+        if self.states is None:
+            self.dims = state.dims
+            n_saved = (self.n_times - 1) // self.save_every + 1
+            self.states = np.lib.format.open_memmap(os.path.join(self.path, 'states.npy'), mode='w+',
+                                                    dtype=complex, shape=(n_saved,) + data.shape)
+        self.states[index] = data
+        self.n_states = max(self.n_states, index + 1)
+
+    def _write_meta(self):
+        meta = {'names': self.names, 'count': self.count, 'save_every': self.save_every,
+                'n_states': self.n_states, 'dims': self.dims}
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def flush(self):
+        """Write buffered rows and the current row count to disk.
+        """
+        self.times.flush()
+        self.values.flush()
+        if self.states is not None:
+            self.states.flush()
+        self._write_meta()
+
+
+class StreamResults(object):
+    """
+    Lazy read-only view of results written by an ObservableStream; nothing is loaded until accessed.
+    results['name'] is the column of an observable, results.times the output times and
+    results.state(i) the i-th saved state as a qutip object.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.path = path
+        self.names = meta['names']
+        self.save_every = meta['save_every']
+        self.dims = meta['dims']
+        count = meta['count']
+        self.times = np.load(os.path.join(path, 'times.npy'), mmap_mode='r')[:count]
+        self.values = np.load(os.path.join(path, 'observables.npy'), mmap_mode='r')[:count]
+        self.states = None
+        if meta['n_states'] > 0:
+            self.states = np.load(os.path.join(path, 'states.npy'), mmap_mode='r')[:meta['n_states']]
+
+    def __getitem__(self, name):
+        return self.values[:, self.names.index(name)]
+
+    def __len__(self):
+        return len(self.times)
+
+    def state(self, i):
+        """Return the i-th saved state (taken at output time index i*save_every) as a qutip object.
+        """
+        if self.states is None:
+            raise ValueError("No states were saved.")
+        return qtp.Qobj(np.array(self.states[i]), dims=self.dims)
+
+
+def open_results(path):
+    """Open the results written by an ObservableStream in path without loading them into memory.
+    """
+    return StreamResults(path)
+
+
+def save_checkpoint(path, meta, **arrays):
+    """Atomically write a checkpoint: a JSON-serializable dictionary meta and numpy arrays.
+    The file is written next to path and then renamed, so an interrupted write never corrupts path.
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, _meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    """Return (meta, arrays) as written by save_checkpoint.
+    """
+    with np.load(path) as data:
+        meta = json.loads(str(data['_meta']))
+        arrays = dict((k, data[k]) for k in data.files if k != '_meta')
+    return meta, arrays
+
+
+def result_arrays(result):
+    """Return a dictionary of numpy arrays representing a solver result (times, expect_0, expect_1, ...,
+    states, final_state and their dims), a dictionary of arrays, a qutip object or an array.
+    """
+    if result is None:
+        return {}
+    if isinstance(result, dict):
+        return dict((str(k), np.asarray(v)) for k, v in result.items())
+    if hasattr(result, 'times') and hasattr(result, 'expect'):
+        arrays = {'times': np.asarray(result.times)}
+        for m, values in enumerate(result.expect or []):
+            arrays['expect_' + str(m)] = np.asarray(values)
+        states = getattr(result, 'states', None)
+        if states is not None and len(states) > 0 and isinstance(states[0], qtp.Qobj):
+            arrays['states'] = np.array([state.full() for state in states])
+            arrays['dims'] = np.array(json.dumps(states[0].dims))
+        final = getattr(result, 'final_state', None)
+        if isinstance(final, qtp.Qobj):
+            arrays['final_state'] = final.full()
+            arrays['final_dims'] = np.array(json.dumps(final.dims))
+        return arrays
+    if isinstance(result, qtp.Qobj):
+        return {'result': result.full(), 'dims': np.array(json.dumps(result.dims))}
+    return {'result': np.asarray(result)}
+
+
+def result_from_arrays(arrays):
+    """Inverse of result_arrays for solver results: return a qutip Result with the times, expectation
+    values, states and final state.
+    """
+    result = qtp.solver.Result()
+    result.times = arrays['times']
+    n_expect = len([k for k in arrays if k.startswith('expect_')])
+    result.expect = [arrays['expect_' + str(m)] for m in range(n_expect)]
+    result.num_expect = n_expect
+    result.states = []
+    if 'states' in arrays:
+        dims = json.loads(str(arrays['dims']))
+        result.states = [qtp.Qobj(state, dims=dims) for state in arrays['states']]
+    result.final_state = None
+    if 'final_state' in arrays:
+        result.final_state = qtp.Qobj(arrays['final_state'], dims=json.loads(str(arrays['final_dims'])))
+    return result
+
+
+class StateHistory(object):
+    """
+    History of the states of a simulation stored as rows of one preallocated contiguous array
+    (time x dimension) that doubles its capacity when full, so appending is amortized O(1) and no
+    qutip object is kept per state. States are converted to qutip objects only when accessed.
+    If a density matrix is appended after kets, the stored kets are converted to density matrices.
+    params
+    dtype = complex (complex128) or np.complex64 to halve the memory
+    decimate = store only every decimate-th appended state; the last state of every append or extend call 
+               (the end of an evolution segment or the state after a gate) is always stored
+    capacity = initial number of rows
+    """
+    def __init__(self, dtype=complex, decimate=1, capacity=64):
+        if decimate < 1:
+            raise ValueError("decimate must be greater than or equal to 1")
+        if capacity < 1:
+            raise ValueError("capacity must be greater than or equal to 1")
+        self.dtype = np.dtype(dtype)
+        self.decimate = decimate
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self._data = None
+        self._times = np.zeros(0)
+        self.n = 0
+        self.count = 0 #number of states appended, stored or not
+        self._last_kept = False
+        self.dims = None
+        self.shape = None
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def states(self):
+        """Read-only view (n, dim, 1) for kets or (n, dim, dim) for density matrices of the stored states.
+        """
+        if self._data is None:
+            return np.zeros((0,), dtype=self.dtype)
+        view = self._data[:self.n].reshape((self.n,) + self.shape)
+        view.flags.writeable = False
+        return view
+
+    @property
+    def times(self):
+        """Read-only view of the times of the stored states.
+        """
+        view = self._times[:self.n]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def nbytes(self):
+        return 0 if self._data is None else self._data.nbytes + self._times.nbytes
+
+    def _qobj(self, row):
+        return qtp.Qobj(np.asarray(self._data[row].reshape(self.shape), dtype=complex), dims=self.dims)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._qobj(i) for i in range(self.n)[index]]
+        if index < 0:
+            index += self.n
+        if not 0 <= index < self.n:
+            raise IndexError("StateHistory index out of range")
+        return self._qobj(index)
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self._qobj(i)
+
+    def to_list(self):
+        """Return the stored states as a list of qutip objects.
+        """
+        return list(self)
+
+    def _reserve(self, rows):
+        if rows > len(self._data):
+            size = max(rows, 2*len(self._data))
+            data = np.empty((size, self._data.shape[1]), dtype=self.dtype)
+            data[:self.n] = self._data[:self.n]
+            times = np.empty(size)
+            times[:self.n] = self._times[:self.n]
+            self._data, self._times = data, times
+
+    def _to_density_matrices(self):
+        kets = self._data[:self.n]
+        d = self.shape[0]
+        data = np.empty((len(self._data), d*d), dtype=self.dtype)
+        data[:self.n] = (kets[:, :, None]*kets[:, None, :].conj()).reshape(self.n, d*d)
+        self._data = data
+        self.shape = (d, d)
+        self.dims = [self.dims[0], self.dims[0]]
+
+    def _put(self, t, state, replace, last):
+        data = state.full()
+        if self._data is None:
+            self._data = np.empty((self.capacity, data.size), dtype=self.dtype)
+            self._times = np.empty(self.capacity)
+            self.shape, self.dims = data.shape, state.dims
+        elif data.shape != self.shape:
+            if self.shape == (data.shape[0], 1) and data.shape == (data.shape[0], data.shape[0]):
+                self._to_density_matrices()
+            elif self.shape == (data.shape[0], data.shape[0]) and data.shape == (data.shape[0], 1):
+                data = np.dot(data, data.conj().T)
+            else:
+                raise ValueError("State of shape " + str(data.shape) + " does not match the stored states "
+                                 + str(self.shape) + "; use transform to change the dimension.")
+        if replace and self._last_kept:
+            self._data[self.n - 1] = data.ravel()
+            self._times[self.n - 1] = t
+            return
+        if replace: #the replaced state was dropped by the decimation, its replacement is stored
+            keep = True
+        else:
+            keep = last or self.count % self.decimate == 0
+            self.count += 1
+        self._last_kept = keep
+        if keep:
+            self._reserve(self.n + 1)
+            self._data[self.n] = data.ravel()
+            self._times[self.n] = t
+            self.n += 1
+
+    def append(self, t, state, replace=False):
+        """Append the state at time t; replace=True overwrites the last appended state instead.
+        """
+        self._put(t, state, replace and self.count > 0, True)
+
+    def extend(self, times, states, overlap=False):
+        """Append states at times; overlap=True means that the first state replaces the last appended one,
+        as when consecutive evolution segments share their boundary time.
+        """
+        n = min(len(times), len(states))
+        for i, (t, state) in enumerate(zip(times, states)):
+            self._put(t, state, overlap and i == 0 and self.count > 0, i == n - 1)
+
+    def transform(self, function):
+        """Replace every stored state psi by function(psi), e.g. to embed them in a larger space.
+        """
+        states, times = self.to_list(), np.array(self.times)
+        count, last_kept = self.count, self._last_kept
+        self.clear()
+        decimate, self.decimate = self.decimate, 1
+        self.extend(times, [function(psi) for psi in states])
+        self.decimate, self.count, self._last_kept = decimate, count, last_kept
+
+    def expect(self, op):
+        """Return the expectation values of the operator op in every stored state, computed on the array.
+        """
+        if self.n == 0:
+            return np.zeros(0)
+        if self.shape[1] == 1:
+            X = np.asarray(self._data[:self.n], dtype=complex)
+            values = np.einsum('nd,nd->n', X.conj(), np.asarray(op.data.dot(X.T)).T)
+        else:
+            d = self.shape[0]
+            rho = np.asarray(self._data[:self.n], dtype=complex).reshape(self.n, d, d)
+            values = np.einsum('ij,nji->n', op.full(), rho)
+        return np.real(values) if op.isherm else values
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("states_list is a read-only view of the simulation history")
+
+
+class StateSequence(list):
+    """
+    Read-only live view of a StateHistory, converting one stored state to a qutip object per access.
+    It subclasses list only so that functions accepting lists of states, such as qutip.expect, take it;
+    the list itself stays empty and every mutating method raises TypeError.
+    """
+    def __init__(self, history):
+        list.__init__(self)
+        self.history = history
+
+    def __len__(self):
+        return len(self.history)
+
+    def __getitem__(self, index):
+        return self.history[index]
+
+    def __iter__(self):
+        return iter(self.history)
+
+    def __reversed__(self):
+        return (self.history[i] for i in range(len(self.history) - 1, -1, -1))
+
+    def __contains__(self, state):
+        return any(psi == state for psi in self)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.history.states, dtype=dtype or complex)
+
+    def __eq__(self, other):
+        return list(self) == list(other) if isinstance(other, (list, tuple)) else NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __mul__(self, n):
+        return list(self)*n
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def index(self, state, *args):
+        return list(self).index(state, *args)
+
+    def count(self, state):
+        return sum(1 for psi in self if psi == state)
+
+    def copy(self):
+        return list(self)
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    append = extend = insert = remove = pop = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
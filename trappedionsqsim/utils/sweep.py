@@ -0,0 +1,180 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import copy
+import itertools
+import os
+import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+#Parallel parameter sweeps over simulation configurations (e.g. experiment.Experiment)
+#2017-2019
+
+
+_WORKER = {}
+
+
+def _init_worker(runner, base, observables, shared):
+    """Store the read-only sweep data once per worker process.
+    """
+    _WORKER['runner'] = runner
+    _WORKER['base'] = base
+    _WORKER['observables'] = observables
+    _WORKER['shared'] = shared
+
+
+def _evaluate(observable, result):
+    if callable(observable):
+        return observable(result)
+    #qutip operator: expectation value along the stored trajectory
+    import qutip as qtp
+    return qtp.expect(observable, result.states)
+
+
+def _run_point(index, overrides):
+    config = copy.deepcopy(_WORKER['base'])
+    for name, value in overrides.items():
+        if not hasattr(config, name):
+            raise ValueError("Configuration has no attribute " + str(name))
+        setattr(config, name, value)
+    result = _WORKER['runner'](config, **_WORKER['shared'])
+    values = dict((name, _evaluate(obs, result)) for name, obs in _WORKER['observables'].items())
+    return index, overrides, values
+
+
+class ParameterSweep(object):
+    """
+    Run a simulation for every point of a list of configuration overrides, in parallel.
+    params
+    runner = function called as runner(config, **shared) returning a result, e.g. RamanSimBC.MQramanDynamicsBC.
+             It must be picklable (defined at module level) when workers > 1.
+    base = base configuration; every point is a deep copy of base with its overrides set as attributes
+    observables = dictionary name -> function(result) or qutip operator (expectation along result.states),
+                  evaluated in the worker so that only the observables are sent back
+    shared = dictionary of read-only data (level structure, couplings, operators, ...) sent once to each
+             worker and passed to every runner call as keyword arguments
+    workers = number of worker processes; 1 runs every point in the current process
+    checkpoint = file recording completed points, so that an interrupted sweep resumes where it stopped
+    """
+    def __init__(self, runner, base, observables, shared=None, workers=1, checkpoint=None):
+        if workers < 1:
+            raise ValueError("Number of workers must be greater than or equal to 1")
+        self.runner = runner
+        self.base = base
+        self.observables = observables
+        self.shared = shared if shared is not None else {}
+        self.workers = workers
+        self.checkpoint = checkpoint
+
+    @staticmethod
+    def grid(**axes):
+        """Return the list of override dictionaries of the Cartesian product of the given axes,
+        e.g. grid(P=[[0, 0], [0, np.pi]], Dicke=[[.05], [.1]]). The last axis varies fastest.
+        """
+        names = list(axes.keys())
+        return [dict(zip(names, values)) for values in itertools.product(*[axes[n] for n in names])]
+
+    def _load_checkpoint(self, points):
+        done = {}
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            return done
+        with open(self.checkpoint, 'r+b') as f:
+            good = 0
+            while True:
+                try:
+                    index, overrides, values = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError, ValueError, TypeError, AttributeError, IndexError):
+                    break
+                good = f.tell()
+                if index < len(points) and _same(points[index], overrides):
+                    done[index] = (index, overrides, values)
+            #a record interrupted while being written is cut off, so that the records appended after it
+            #can be read back; its point is recomputed
+            if f.seek(0, os.SEEK_END) > good:
+                f.truncate(good)
+        return done
+
+    def iterate(self, points, ordered=True):
+        """
+        params
+        points is a list of override dictionaries
+        ordered = True yields results in the order of points, False yields them as they complete
+        yields (index, overrides, values) with values a dictionary of the observables of each point
+        """
+        points = list(points)
+        done = self._load_checkpoint(points)
+        todo = [i for i in range(len(points)) if i not in done]
+        record = open(self.checkpoint, 'ab') if self.checkpoint is not None else None
+        try:
+            if self.workers == 1:
+                _init_worker(self.runner, self.base, self.observables, self.shared)
+                results = (_run_point(i, points[i]) for i in todo)
+            else:
+                executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                               initargs=(self.runner, self.base, self.observables, self.shared))
+                futures = [executor.submit(_run_point, i, points[i]) for i in todo]
+                results = (f.result() for f in (futures if ordered else as_completed(futures)))
+
+            if not ordered:
+                for i in sorted(done):
+                    yield done[i]
+            pending = sorted(done)
+            try:
+                for item in results:
+                    if record is not None:
+                        pickle.dump(item, record)
+                        record.flush()
+                    if ordered:
+                        #results restored from the checkpoint are interleaved in index order
+                        while pending and pending[0] < item[0]:
+                            yield done[pending.pop(0)]
+                    yield item
+                for i in pending if ordered else []:
+                    yield done[i]
+            finally:
+                if self.workers > 1:
+                    executor.shutdown(cancel_futures=True)
+        finally:
+            if record is not None:
+                record.close()
+
+    def run(self, points):
+        """
+        params
+        points is a list of override dictionaries, e.g. from ParameterSweep.grid(...)
+        return a numpy structured array with one row per point, one field per override and one per observable.
+        Real or complex scalar observables are stored as numbers, anything else as objects.
+        """
+        points = list(points)
+        rows = [None]*len(points)
+        for index, overrides, values in self.iterate(points, ordered=False):
+            rows[index] = (overrides, values)
+
+        names = []
+        for overrides, values in rows:
+            names += [n for n in overrides if n not in names]
+        fields = [(n, object) for n in names]
+        for n in self.observables:
+            fields.append((n, _field_type([values[n] for overrides, values in rows])))
+        table = np.empty(len(rows), dtype=fields)
+        for i, (overrides, values) in enumerate(rows):
+            for n in names:
+                table[n][i] = overrides.get(n)
+            for n in self.observables:
+                table[n][i] = values[n]
+        return table
+
+
+def _same(a, b):
+    try:
+        return pickle.dumps(a) == pickle.dumps(b)
+    except Exception:
+        return False
+
+
+def _field_type(values):
+    if all(np.isscalar(v) and np.isrealobj(v) and isinstance(v, (int, float, np.number)) for v in values):
+        return float
+    if all(np.isscalar(v) and isinstance(v, (int, float, complex, np.number)) for v in values):
+        return complex
+    return object
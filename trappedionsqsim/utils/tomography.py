@@ -0,0 +1,56 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import qutip as qtp
+import numpy as np
+
+#Process tomography of simulated gates from the evolved logical basis states
+#2017-2019
+
+
+def kraus_operators(outputs, logical, n_system):
+    """
+    params
+    outputs is the list of final kets U|j>|env> for each logical input state |j>, j = 0..d-1
+    logical is the list of the d logical kets of the system (the first n_system subsystems),
+    onto which the outputs are projected; population leaving them makes the channel trace-decreasing
+    n_system is the number of leading subsystems kept; the others (e.g. the motional modes) are traced out
+    return the list of d x d Kraus operators K_m[a, j] = (<a|<m|) U |j>|env>, one per environment basis state m
+    """
+    d = len(logical)
+    if len(outputs) != d:
+        raise ValueError("One output state per logical state is required.")
+    dims = outputs[0].dims[0]
+    D_sys = int(np.prod(dims[:n_system]))
+    L = np.array([np.asarray(l.full()).ravel() for l in logical]) #(d, D_sys)
+    if L.shape[1] != D_sys:
+        raise ValueError("Logical states must live in the space of the first n_system subsystems.")
+    A = np.array([np.asarray(o.full()).reshape(D_sys, -1) for o in outputs]) #(j, s, m)
+    K = np.einsum('as,jsm->maj', L.conj(), A)
+    return [qtp.Qobj(k) for k in K]
+
+
+def process_tomography(outputs, logical, n_system, target=None):
+    """
+    params
+    outputs, logical, n_system as in kraus_operators
+    target is an optional d x d target unitary (qutip operator or array) in the logical basis
+    return a dictionary with the Kraus operators ('kraus'), the superoperator ('super'), the chi matrix in
+    the Pauli basis ('chi', for qubits) and, if target is set, the process fidelity and the average gate fidelity
+        F_pro = sum_m |Tr(V^dagger K_m)|^2/d^2
+        F_avg = (sum_m |Tr(V^dagger K_m)|^2 + Tr(sum_m K_m^dagger K_m))/(d*(d + 1))
+    which remain valid for trace-decreasing (leaky) channels.
+    """
+    kraus = kraus_operators(outputs, logical, n_system)
+    d = len(logical)
+    process = {'kraus': kraus, 'super': qtp.kraus_to_super(kraus)}
+    n_qubits = int(round(np.log2(d)))
+    if 2**n_qubits == d:
+        process['super'].dims = [[[2]*n_qubits]*2]*2
+        process['chi'] = qtp.to_chi(process['super'])
+    if target is not None:
+        V = target.full() if isinstance(target, qtp.Qobj) else np.asarray(target, dtype=complex)
+        overlap = sum(abs(np.trace(np.dot(V.conj().T, K.full())))**2 for K in kraus)
+        survival = np.real(sum(np.trace(np.dot(K.full().conj().T, K.full())) for K in kraus))
+        process['process_fidelity'] = overlap/d**2
+        process['average_gate_fidelity'] = (overlap + survival)/(d*(d + 1))
+    return process
@@ -0,0 +1,130 @@
+from __future__ import division, absolute_import, print_function, unicode_literals
+
+import copy
+import qutip as qtp
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+#Reproducible parallel Monte Carlo wave function trajectories with streaming statistics
+#2017-2019
+
+
+def trajectory_seed(seed, index):
+    """Return the solver seed of trajectory index, derived from seed with numpy's SeedSequence,
+    so that it only depends on (seed, index).
+    """
+    return int(np.random.SeedSequence(seed, spawn_key=(index,)).generate_state(1)[0])
+
+
+def _run_batch(Hamiltonian_list, psi0, t_arr, c_ops, observable_list, seeds, options):
+    """Run one trajectory per seed; return the per-trajectory expectation values (n_traj, n_obs, n_times)
+    and final kets (n_traj, dim).
+    """
+    options = copy.copy(options) if options is not None else qtp.Options()
+    options.seeds = list(seeds)
+    options.average_expect = False
+    options.average_states = False
+    options.store_states = False
+    options.store_final_state = True
+    output = qtp.mcsolve(Hamiltonian_list, psi0, t_arr, c_ops, observable_list, ntraj=len(seeds),
+                         options=options, progress_bar=None, map_func=qtp.serial_map)
+    expect = np.zeros((len(seeds), len(observable_list), len(t_arr)), dtype=complex)
+    for m in range(len(observable_list)):
+        for k in range(len(seeds)):
+            expect[k, m] = output.expect[k][m]
+    finals = np.array([np.asarray(state.full()).ravel() for state in output.final_state])
+    return expect, finals
+
+
+class TrajectoryEngine(object):
+    """
+    Monte Carlo wave function trajectories run in fixed batches over a process pool.
+    Trajectory i is seeded with trajectory_seed(seed, i) and batches are folded in index order into
+    running means and variances (Welford's algorithm), so results are bit-identical for a given seed
+    whatever the number of workers. After each batch the run stops once the standard error of every
+    observable at every time is below target_error.
+    params
+    ntraj = maximum number of trajectories
+    batch_size = number of trajectories per batch; also the granularity of early stopping
+    workers = number of worker processes; 1 runs the batches in the current process
+    seed = root seed of the run
+    target_error = standard error at which to stop (None runs all ntraj trajectories)
+    min_traj = number of trajectories before early stopping is considered
+    """
+    def __init__(self, ntraj=500, batch_size=50, workers=1, seed=0, target_error=None, min_traj=100):
+        if ntraj < 1 or batch_size < 1:
+            raise ValueError("ntraj and batch_size must be greater than or equal to 1")
+        if workers < 1:
+            raise ValueError("Number of workers must be greater than or equal to 1")
+        self.ntraj = ntraj
+        self.batch_size = batch_size
+        self.workers = workers
+        self.seed = seed
+        self.target_error = target_error
+        self.min_traj = min_traj
+
+    def _batches(self):
+        for start in range(0, self.ntraj, self.batch_size):
+            stop = min(start + self.batch_size, self.ntraj)
+            yield [trajectory_seed(self.seed, i) for i in range(start, stop)]
+
+    def run(self, Hamiltonian_list, psi0, t_arr, c_ops, observable_list=[], options=None):
+        """
+        params
+        Hamiltonian_list, psi0, t_arr, c_ops, observable_list and options as for qutip.mcsolve
+        return a qutip Result with the mean expectation values (expect), their standard errors (stderr),
+        the number of trajectories run (ntraj) and the final density matrix averaged over trajectories
+        """
+        if not psi0.isket:
+            raise ValueError("Initial state must be a ket.")
+        args = (Hamiltonian_list, psi0, t_arr, c_ops, observable_list)
+        n = 0
+        mean = np.zeros((len(observable_list), len(t_arr)), dtype=complex)
+        M2 = np.zeros((len(observable_list), len(t_arr)))
+        rho = np.zeros((psi0.shape[0], psi0.shape[0]), dtype=complex)
+
+        if self.workers == 1:
+            results = (_run_batch(*(args + (seeds, options))) for seeds in self._batches())
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(self.workers)
+            batches = self._batches()
+            pending = [executor.submit(_run_batch, *(args + (seeds, options)))
+                       for i, seeds in zip(range(2*self.workers), batches)]
+            def ordered():
+                #keep 2*workers batches in flight, consuming them in submission order
+                while pending:
+                    result = pending.pop(0).result()
+                    seeds = next(batches, None)
+                    if seeds is not None:
+                        pending.append(executor.submit(_run_batch, *(args + (seeds, options))))
+                    yield result
+            results = ordered()
+
+        try:
+            for expect, finals in results:
+                for k in range(len(expect)):
+                    n += 1
+                    delta = expect[k] - mean
+                    mean += delta/n
+                    M2 += np.real(delta.conj()*(expect[k] - mean))
+                    rho += np.outer(finals[k], finals[k].conj())
+                stderr = np.sqrt(M2/(n - 1)/n) if n > 1 else np.full(M2.shape, np.inf)
+                if self.target_error is not None and n >= self.min_traj and \
+                        (stderr.size == 0 or stderr.max() <= self.target_error):
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        result = qtp.solver.Result()
+        result.solver = 'TrajectoryEngine'
+        result.times = t_arr
+        result.ntraj = n
+        result.seeds = [trajectory_seed(self.seed, i) for i in range(n)]
+        result.expect = [mean[m] for m in range(len(observable_list))]
+        result.stderr = [stderr[m] for m in range(len(observable_list))]
+        result.num_expect = len(observable_list)
+        result.final_state = qtp.Qobj(rho/n, dims=[psi0.dims[0], psi0.dims[0]])
+        return result
+